@@ -1,6 +1,19 @@
 import os
 import requests
 from urllib.parse import urlparse, urljoin
+from image_formats import EXTENSIONS, sniff_image_format
+
+def get_filename(url, image_format=None):
+    """Generate a filename from the URL and the sniffed image format."""
+    parsed_url = urlparse(url)
+    base_name = os.path.basename(parsed_url.path).split("?")[0]
+    if not base_name:  # Fallback filename
+        base_name = "downloaded_image"
+    # Add extension based on the actual image format
+    extension = EXTENSIONS.get(image_format, "jpg")
+    if not base_name.endswith(f".{extension}"):
+        base_name += f".{extension}"
+    return base_name
 
 def download_image(urls, output_dir="images"):
     """
@@ -13,18 +26,6 @@ def download_image(urls, output_dir="images"):
     # Ensure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
     
-    def get_filename(url, content_type=None):
-        """Generate a filename from the URL or Content-Type."""
-        parsed_url = urlparse(url)
-        base_name = os.path.basename(parsed_url.path).split("?")[0]
-        if not base_name:  # Fallback filename
-            base_name = "downloaded_image"
-        # Add extension based on content-type
-        extension = content_type.split("/")[-1] if content_type else "jpg"
-        if not base_name.endswith(f".{extension}"):
-            base_name += f".{extension}"
-        return base_name
-    
     def download_single_image(url):
         """Download a single image and save it."""
         headers = {
@@ -35,19 +36,22 @@ def download_image(urls, output_dir="images"):
             response = requests.get(url, headers=headers, stream=True, timeout=10)
             response.raise_for_status()  # Raise HTTP errors
 
-            # Verify content type is an image
-            content_type = response.headers.get("Content-Type", "")
-            if not content_type.startswith("image/"):
+            # Verify the payload is an image from its magic bytes rather than the Content-Type header
+            chunks = response.iter_content(1024)
+            first_chunk = next(chunks, b"")
+            image_format = sniff_image_format(first_chunk)
+            if image_format is None:
                 print(f"URL does not point to an image: {url}")
                 return
 
             # Determine filename and save path
-            filename = get_filename(url, content_type)
+            filename = get_filename(url, image_format)
             save_path = os.path.join(output_dir, filename)
 
             # Write the image data to file
             with open(save_path, "wb") as f:
-                for chunk in response.iter_content(1024):
+                f.write(first_chunk)
+                for chunk in chunks:
                     f.write(chunk)
             print(f"Downloaded: {save_path}")
         except requests.RequestException as e:
@@ -1,10 +1,11 @@
 import streamlit as st
-from PIL import Image
-import io
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
-import requests
+from background_trim import trim_model_image
+from image_formats import prepare_model_image
+from model_cascade import create_default_cascade
+from prefetch import fetch_image_bytes
 
 # Load environment variables
 load_dotenv()
@@ -12,19 +13,13 @@ load_dotenv()
 # Google API Configuration
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("models/gemini-1.5-flash-002")
+cascade = create_default_cascade()
 
 # Function to generate image descriptions using LLM
 def generate_image_descriptions(image, prompt):
     """Send image and prompt to LLM to get descriptions."""
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format=image.format)
-    img_byte_arr.seek(0)  # Go back to the start of the buffer
-
-    # Generate response using the model
-    response = model.generate_content([prompt, image])
-    generated_text = response.candidates[0].content.parts[0].text
-    return generated_text
+    # Generate response through the flash -> pro model cascade
+    return cascade.generate([prompt, image.as_part()]).text
 
  # Function to get prompt based on image type
 def get_prompt(image_type):
@@ -83,11 +78,10 @@ def get_prompt(image_type):
 def load_image(image_source):
     try:
         if isinstance(image_source, str) and image_source.startswith("http"):
-            response = requests.get(image_source)
-            response.raise_for_status()
-            return Image.open(io.BytesIO(response.content))
+            # Pooled client with connect/read timeouts and an overall download deadline
+            return prepare_model_image(fetch_image_bytes(image_source))
         else:
-            return Image.open(image_source)
+            return prepare_model_image(image_source.getvalue())
     except Exception:
         st.error("Image not supported or usage limit reached. Please try again or contact the developer.")
         return None
@@ -106,11 +100,15 @@ def main():
         image = load_image(image_source)
         
         if image:
-            st.image(image, caption='Uploaded Image', width=300)
+            st.image(image.data, caption='Uploaded Image', width=300)
             prompt = get_prompt(image_type)
 
             if st.button("Generate Description"):
                 try:
+                    if image_type == "Product Image":
+                        # Crop the plain background so the model only receives the product
+                        image, trim_report = trim_model_image(image)
+                        st.caption(trim_report.summary())
                     generated_text = generate_image_descriptions(image, prompt)
                     st.write("**Generated Description:**", generated_text)
                 except Exception:
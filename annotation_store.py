@@ -0,0 +1,304 @@
+"""Persistent store for every generated and edited caption.
+
+SQLite in WAL mode with indexes on SKU, URL and image hash, and an FTS5 index over the raw
+and edited descriptions. Exports stream rows in batches (keyset pagination), so they run
+in constant memory at any table size.
+
+    python annotation_store.py search "sleeveless dress" --limit 20
+    python annotation_store.py export annotations.parquet --format parquet
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+ANNOTATION_DB = os.getenv("ANNOTATION_DB", "annotations.sqlite3")
+
+EXPORT_BATCH_SIZE = 10000
+
+COLUMNS = (
+    "id", "image_hash", "url", "sku", "image_type", "model", "prompt_version",
+    "raw_output", "repaired_output", "edited_output", "created_at", "updated_at",
+)
+
+# Product codes in catalog URLs, e.g. ".../journal-womenlongdresssleeveless-CDS11914655-5"
+_SKU_RE = re.compile(r"(?<![A-Za-z0-9])([A-Z]{2,5}\d{5,})(?![0-9])")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    url TEXT,
+    sku TEXT,
+    image_type TEXT NOT NULL,
+    model TEXT,
+    prompt_version TEXT,
+    raw_output TEXT NOT NULL,
+    repaired_output TEXT,
+    edited_output TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_annotations_sku ON annotations (sku);
+CREATE INDEX IF NOT EXISTS idx_annotations_url ON annotations (url);
+CREATE INDEX IF NOT EXISTS idx_annotations_image_hash ON annotations (image_hash);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS annotations_fts USING fts5(
+    raw_output, edited_output, content='annotations', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS annotations_ai AFTER INSERT ON annotations BEGIN
+    INSERT INTO annotations_fts (rowid, raw_output, edited_output)
+    VALUES (new.id, new.raw_output, new.edited_output);
+END;
+CREATE TRIGGER IF NOT EXISTS annotations_ad AFTER DELETE ON annotations BEGIN
+    INSERT INTO annotations_fts (annotations_fts, rowid, raw_output, edited_output)
+    VALUES ('delete', old.id, old.raw_output, old.edited_output);
+END;
+CREATE TRIGGER IF NOT EXISTS annotations_au AFTER UPDATE OF raw_output, edited_output ON annotations BEGIN
+    INSERT INTO annotations_fts (annotations_fts, rowid, raw_output, edited_output)
+    VALUES ('delete', old.id, old.raw_output, old.edited_output);
+    INSERT INTO annotations_fts (rowid, raw_output, edited_output)
+    VALUES (new.id, new.raw_output, new.edited_output);
+END;
+"""
+
+
+def extract_sku(url):
+    """Return the product code found in a catalog URL, or None."""
+    match = _SKU_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+def prompt_version(prompt):
+    """Short stable identifier for a prompt text, so captions can be traced to the prompt used."""
+    return hashlib.sha256(prompt.encode()).hexdigest()[:12]
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query matching all words (prefix match on the last one)."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return " ".join(terms)
+
+
+class AnnotationStore:
+    """Captions with their provenance, indexed for lookup, search and streaming export."""
+
+    def __init__(self, path=ANNOTATION_DB):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        # Stores created before repaired_output existed
+        if "repaired_output" not in {row["name"] for row in conn.execute("PRAGMA table_info(annotations)")}:
+            conn.execute("ALTER TABLE annotations ADD COLUMN repaired_output TEXT")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, image_hash, image_type, raw_output, url=None, sku=None, model=None, prompt=None, repaired_output=None):
+        """Record a generated caption and return its id.
+
+        `raw_output` is the model's answer as returned; `repaired_output` is the text shown to the
+        editor when an automatic fix (e.g. the short-description repair) changed it.
+        """
+        now = time.time()
+        if repaired_output == raw_output:
+            repaired_output = None
+        cursor = self._connect().execute(
+            "INSERT INTO annotations (image_hash, url, sku, image_type, model, prompt_version,"
+            " raw_output, repaired_output, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                image_hash, url, sku or extract_sku(url), image_type, model,
+                prompt_version(prompt) if prompt else None, raw_output, repaired_output, now, now,
+            ),
+        )
+        return cursor.lastrowid
+
+    def update_edited(self, annotation_id, edited_output):
+        """Save the editor's version of a caption."""
+        self._connect().execute(
+            "UPDATE annotations SET edited_output = ?, updated_at = ? WHERE id = ?",
+            (edited_output, time.time(), annotation_id),
+        )
+
+    def get(self, annotation_id):
+        row = self._connect().execute("SELECT * FROM annotations WHERE id = ?", (annotation_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _find(self, column, value, limit):
+        rows = self._connect().execute(
+            f"SELECT * FROM annotations WHERE {column} = ? ORDER BY id DESC LIMIT ?", (value, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def find_by_sku(self, sku, limit=100):
+        return self._find("sku", sku, limit)
+
+    def find_by_url(self, url, limit=100):
+        return self._find("url", url, limit)
+
+    def find_by_hash(self, image_hash, limit=100):
+        return self._find("image_hash", image_hash, limit)
+
+    def search(self, text, limit=50):
+        """Full-text search over raw and edited descriptions, best matches first."""
+        query = _fts_query(text)
+        if query is None:
+            return []
+        rows = self._connect().execute(
+            "SELECT a.* FROM annotations_fts JOIN annotations a ON a.id = annotations_fts.rowid"
+            " WHERE annotations_fts MATCH ? ORDER BY bm25(annotations_fts) LIMIT ?",
+            (query, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def iter_batches(self, batch_size=EXPORT_BATCH_SIZE, since=None):
+        """Yield lists of row tuples (in COLUMNS order) by id, without holding a read cursor open."""
+        # A dedicated connection keeps long exports off the connection used for writes
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            last_id = 0
+            while True:
+                params = [last_id]
+                where = "id > ?"
+                if since is not None:
+                    where += " AND updated_at >= ?"
+                    params.append(since)
+                rows = conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM annotations WHERE {where} ORDER BY id LIMIT ?",
+                    params + [batch_size],
+                ).fetchall()
+                if not rows:
+                    return
+                yield rows
+                last_id = rows[-1][0]
+        finally:
+            conn.close()
+
+    def export(self, path, format=None, since=None):
+        """Stream all annotations (optionally those updated since a timestamp) to CSV, JSONL or Parquet.
+
+        Returns the number of rows written.
+        """
+        format = (format or os.path.splitext(path)[1].lstrip(".")).lower()
+        if format == "csv":
+            return self._export_csv(path, since)
+        if format == "jsonl":
+            return self._export_jsonl(path, since)
+        if format == "parquet":
+            return self._export_parquet(path, since)
+        raise ValueError(f"Unsupported export format: {format!r} (use csv, jsonl or parquet)")
+
+    def _export_csv(self, path, since):
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for rows in self.iter_batches(since=since):
+                writer.writerows(rows)
+                count += len(rows)
+        return count
+
+    def _export_jsonl(self, path, since):
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for rows in self.iter_batches(since=since):
+                f.writelines(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+                count += len(rows)
+        return count
+
+    def _export_parquet(self, path, since):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+
+        schema = pa.schema([
+            ("id", pa.int64()), ("image_hash", pa.string()), ("url", pa.string()), ("sku", pa.string()),
+            ("image_type", pa.string()), ("model", pa.string()), ("prompt_version", pa.string()),
+            ("raw_output", pa.string()), ("repaired_output", pa.string()), ("edited_output", pa.string()),
+            ("created_at", pa.float64()), ("updated_at", pa.float64()),
+        ])
+        count = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            for rows in self.iter_batches(since=since):
+                columns = list(zip(*rows))
+                writer.write_batch(pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+                count += len(rows)
+        return count
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Function to get the process-wide annotation store
+def get_annotation_store():
+    """Return the shared AnnotationStore, creating it on first use (Streamlit reruns reuse it)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AnnotationStore(ANNOTATION_DB)
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or export the caption annotation store.")
+    parser.add_argument("--db", default=ANNOTATION_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="Full-text search over descriptions.")
+    search.add_argument("text")
+    search.add_argument("--limit", type=int, default=20)
+
+    lookup = commands.add_parser("lookup", help="Find captions by SKU, URL or image hash.")
+    lookup.add_argument("--sku")
+    lookup.add_argument("--url")
+    lookup.add_argument("--hash")
+
+    export = commands.add_parser("export", help="Stream all captions to a file.")
+    export.add_argument("path")
+    export.add_argument("--format", choices=("csv", "jsonl", "parquet"))
+    export.add_argument("--since", type=float, help="Only rows updated at or after this Unix timestamp.")
+
+    args = parser.parse_args()
+    store = AnnotationStore(args.db)
+    if args.command == "export":
+        count = store.export(args.path, args.format, args.since)
+        print(f"Exported {count} annotations to {args.path}")
+        return
+
+    if args.command == "search":
+        rows = store.search(args.text, args.limit)
+    elif args.sku:
+        rows = store.find_by_sku(args.sku)
+    elif args.url:
+        rows = store.find_by_url(args.url)
+    elif args.hash:
+        rows = store.find_by_hash(args.hash)
+    else:
+        parser.error("lookup needs --sku, --url or --hash")
+    for row in rows:
+        sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Crop uniform background around product shots before they are sent to the model.
+
+The background color is estimated from the image border (the per-channel median of the
+outermost pixels). Pixels that differ from it by more than the tolerance on any channel
+are content; the image is cropped to the content bounding box plus a margin. Transparent
+borders are handled the same way via the alpha channel. Everything is vectorized NumPy
+over the decoded pixels; finding the box on a catalog-sized image takes about a millisecond.
+Decisions (the cropped image, or just "not trimmed") are cached by source digest and settings,
+so regenerating a caption doesn't decode and re-encode the same image again. Sources that are
+transcoded anyway (AVIF, HEIF, ...) are trimmed by _transcode from the decoded source pixels,
+so their cropped payload is encoded once instead of going through a second lossy JPEG pass.
+"""
+import os
+
+import numpy as np
+
+from image_formats import TranscodeCache, encode_model_image
+
+# Largest per-channel difference (0-255) from the background color still counted as background
+TRIM_TOLERANCE = int(os.getenv("TRIM_TOLERANCE", "12"))
+
+# Space kept around the content, as a fraction of the content's longest side
+TRIM_MARGIN = float(os.getenv("TRIM_MARGIN", "0.03"))
+
+# Crops saving less than this share of the pixels are skipped to avoid a needless re-encode
+TRIM_MIN_SAVED_FRACTION = 0.1
+
+# Share of border pixels that must match the background for it to count as uniform
+BORDER_UNIFORMITY = 0.9
+
+# Rough size charged per cached decision on top of any cropped image, so "not trimmed" entries are bounded too
+TRIM_ENTRY_OVERHEAD = 1024
+
+
+class TrimReport:
+    """What a trim did: sizes before and after, and the crop box (None when not trimmed)."""
+
+    def __init__(self, original_size, trimmed_size, box=None, reason=None, original_bytes=None, trimmed_bytes=None):
+        self.original_size = original_size
+        self.trimmed_size = trimmed_size
+        self.box = box
+        self.reason = reason
+        self.original_bytes = original_bytes
+        self.trimmed_bytes = trimmed_bytes
+
+    @property
+    def trimmed(self):
+        return self.box is not None
+
+    @property
+    def pixels_saved(self):
+        return self.original_size[0] * self.original_size[1] - self.trimmed_size[0] * self.trimmed_size[1]
+
+    @property
+    def saved_fraction(self):
+        total = self.original_size[0] * self.original_size[1]
+        return self.pixels_saved / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            "trimmed": self.trimmed,
+            "original_size": list(self.original_size),
+            "trimmed_size": list(self.trimmed_size),
+            "pixels_saved": self.pixels_saved,
+            "saved_fraction": round(self.saved_fraction, 3),
+            "original_bytes": self.original_bytes,
+            "trimmed_bytes": self.trimmed_bytes,
+            "reason": self.reason,
+        }
+
+    def summary(self):
+        if not self.trimmed:
+            return f"Background not trimmed ({self.reason})."
+        (width, height), (new_width, new_height) = self.original_size, self.trimmed_size
+        return (
+            f"Trimmed background: {width}x{height} -> {new_width}x{new_height}, "
+            f"{self.saved_fraction:.0%} fewer pixels and {self.original_bytes - self.trimmed_bytes:,} fewer bytes "
+            f"sent to the model."
+        )
+
+
+class TrimResult:
+    """A cached trim decision; `image` is None when the source is used as-is, so the cache never pins it."""
+
+    def __init__(self, image, report):
+        self.image = image
+        self.report = report
+
+    @property
+    def nbytes(self):
+        return TRIM_ENTRY_OVERHEAD + (self.image.nbytes if self.image is not None else 0)
+
+
+trim_cache = TranscodeCache(int(os.getenv("TRIM_CACHE_MB", "64")) * 1024 * 1024)
+
+
+def border_pixels(pixels):
+    """The outermost row and column pixels of an (H, W, C) array, as (N, C)."""
+    return np.concatenate([pixels[0], pixels[-1], pixels[1:-1, 0], pixels[1:-1, -1]])
+
+
+# Function to find the content bounding box of an image on a uniform background
+def find_content_box(pixels, tolerance=TRIM_TOLERANCE):
+    """Return (left, top, right, bottom) of the content, or None if the border isn't a uniform background.
+
+    `pixels` is an (H, W, 3) RGB or (H, W, 4) RGBA uint8 array.
+    """
+    height, width = pixels.shape[:2]
+    border = border_pixels(pixels).astype(np.int16)
+    if pixels.shape[2] == 4 and np.median(border[:, 3]) <= tolerance:
+        # Transparent background: anything visible is content
+        outside = pixels[:, :, 3] > tolerance
+        channels = 1
+    else:
+        background = np.median(border[:, :3], axis=0)
+        if np.mean(np.abs(border[:, :3] - background).max(axis=1) <= tolerance) < BORDER_UNIFORMITY:
+            return None
+        # Compare uint8 rows against per-channel bounds tiled across the width; this keeps the
+        # inner loop contiguous and avoids widening the whole image to a signed type
+        lower = np.tile(np.clip(background - tolerance, 0, 255).astype(np.uint8), width)
+        upper = np.tile(np.clip(background + tolerance, 0, 255).astype(np.uint8), width)
+        flat = pixels[:, :, :3].reshape(height, width * 3)
+        outside = (flat < lower) | (flat > upper)
+        channels = 3
+
+    rows = np.flatnonzero(outside.any(axis=1))
+    columns = np.flatnonzero(outside.any(axis=0).reshape(width, channels).any(axis=1))
+    if rows.size == 0:
+        return None
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def add_margin(box, size, margin=TRIM_MARGIN):
+    """Grow a box by margin * its longest side on every edge, clamped to the image size."""
+    left, top, right, bottom = box
+    pad = int(round(max(right - left, bottom - top) * margin))
+    width, height = size
+    return max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad)
+
+
+# Function to crop a model image to its content before encoding
+def trim_model_image(model_image, tolerance=TRIM_TOLERANCE, margin=TRIM_MARGIN):
+    """Return (ModelImage, TrimReport); the original is returned unchanged when trimming wouldn't help.
+
+    Results are cached per source digest, tolerance and margin.
+    """
+    key = _trim_key(model_image, tolerance, margin)
+    cached = trim_cache.get(key)
+    if cached is None:
+        with model_image.to_pil() as image:
+            cached = _trim(image, model_image, tolerance, margin)
+        trim_cache.put(key, cached)
+    return cached.image or model_image, cached.report
+
+
+# Function to trim a just-decoded source while its original pixels are at hand
+def trim_decoded_image(image, model_image, tolerance=TRIM_TOLERANCE, margin=TRIM_MARGIN):
+    """Called by _transcode with the decoded source and the ModelImage encoded from it.
+
+    Caches the decision for trim_model_image, which then skips decoding the lossy transcode.
+    """
+    key = _trim_key(model_image, tolerance, margin)
+    if trim_cache.get(key) is None:
+        trim_cache.put(key, _trim(image, model_image, tolerance, margin))
+
+
+def _trim_key(model_image, tolerance, margin):
+    return f"{model_image.digest}:trim:{tolerance}:{margin}"
+
+
+def _trim(image, model_image, tolerance, margin):
+    """Crop the decoded pixels of model_image; returns a TrimResult."""
+    size = (model_image.width, model_image.height)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    box = find_content_box(np.asarray(image), tolerance)
+    if box is None:
+        return TrimResult(None, TrimReport(size, size, reason="no uniform background"))
+    box = add_margin(box, size, margin)
+    report = TrimReport(size, (box[2] - box[0], box[3] - box[1]), box)
+    if report.saved_fraction < TRIM_MIN_SAVED_FRACTION:
+        return TrimResult(None, TrimReport(size, size, reason=f"would save only {report.saved_fraction:.0%}"))
+    # WebP sources stay WebP; re-encoding them as JPEG can make the payload larger than the original
+    trimmed = encode_model_image(image.crop(box), model_image.source_format, keep_webp=model_image.mime_type == "image/webp")
+    if len(trimmed.data) >= len(model_image.data):
+        # Heavily compressed sources can come out larger after re-encoding; fewer pixels alone isn't worth it
+        return TrimResult(None, TrimReport(size, size, reason="re-encoded crop was not smaller"))
+    report.original_bytes = len(model_image.data)
+    report.trimmed_bytes = len(trimmed.data)
+    return TrimResult(trimmed, report)
@@ -0,0 +1,388 @@
+"""HTTP caption service for machine-to-machine use (e.g. the PIM system).
+
+Shares get_prompt and the model cascade with the Streamlit apps through captioning.py.
+
+Endpoints:
+    POST /v1/captions          one image -> caption
+    POST /v1/captions/batch    {"items": [...]} -> captions, processed concurrently within one deadline
+    POST /v1/jobs              submit one image or {"items": [...]} asynchronously -> job id
+    GET  /v1/jobs/<job_id>     poll a job's status and result
+    GET  /healthz              liveness plus memory figures
+
+An image is given as {"image_url": ..., "image_type": ...} or {"image_base64": ..., "image_type": ...}
+in JSON, or as a multipart upload with an "image" file and an "image_type" form field. An optional
+"sku" is recorded with the caption in the annotation store, and "refresh": true skips the cached
+caption. Only captions that passed validation are cached, for CAPTION_CACHE_TTL_SECONDS.
+
+Requests need "Authorization: Bearer $CAPTION_SERVICE_TOKEN". Without a token the service only
+answers callers on the same host, and `python caption_service.py` binds to 127.0.0.1.
+
+Results and jobs live in a SQLite file (CAPTION_SERVICE_DB) shared by every worker process,
+so run several workers behind one port for throughput:
+    CAPTION_SERVICE_TOKEN=... gunicorn -w 4 --threads 8 -b 0.0.0.0:8000 caption_service:app
+"""
+import base64
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify, request
+
+from annotation_store import get_annotation_store
+from background_trim import trim_model_image
+from deadlines import REQUEST_DEADLINE_SECONDS, Deadline, DeadlineExceeded
+from image_formats import prepare_model_image
+from image_memory import image_memory
+from captioning import cascade, generate_caption, get_prompt
+from prefetch import fetch_image_bytes
+
+IMAGE_TYPES = ("Product Image", "Lifestyle Image")
+
+CAPTION_SERVICE_DB = os.getenv("CAPTION_SERVICE_DB", "caption_service.sqlite3")
+CAPTION_WORKERS = int(os.getenv("CAPTION_WORKERS", "8"))
+CAPTION_SERVICE_TOKEN = os.getenv("CAPTION_SERVICE_TOKEN")
+MAX_BATCH_SIZE = int(os.getenv("CAPTION_MAX_BATCH_SIZE", "100"))
+
+# Budget for a whole batch, from when the request arrives (or the job starts); items still
+# queued when it runs out fail with 504 instead of starting with a budget of their own
+BATCH_DEADLINE_SECONDS = float(os.getenv("CAPTION_BATCH_DEADLINE_SECONDS", "300"))
+
+# Cached captions older than this are generated again
+CAPTION_CACHE_TTL_SECONDS = float(os.getenv("CAPTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Finished jobs older than this are deleted
+JOB_RETENTION_SECONDS = 24 * 3600
+
+# A queued or running job not updated for this long is assumed lost with its worker
+JOB_STALE_SECONDS = float(os.getenv("CAPTION_JOB_STALE_SECONDS", "3600"))
+
+# Identifies the worker process that owns a job, to reap jobs whose worker died
+HOSTNAME = socket.gethostname()
+
+
+class CaptionError(Exception):
+    """A request that can't be captioned; carries the HTTP status to report."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ResultStore:
+    """Caption cache and job table in one SQLite file, safe to share between worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS captions ("
+                " cache_key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, error TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL, owner TEXT)"
+            )
+            # Job tables created before the owner column existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def _connect(self):
+        # One connection per thread; sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_caption(self, cache_key):
+        row = self._connect().execute(
+            "SELECT result FROM captions WHERE cache_key = ? AND created_at >= ?",
+            (cache_key, time.time() - CAPTION_CACHE_TTL_SECONDS),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_caption(self, cache_key, result):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO captions (cache_key, result, created_at) VALUES (?, ?, ?)",
+            (cache_key, json.dumps(result), time.time()),
+        )
+
+    def create_job(self):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO jobs (job_id, status, created_at, updated_at, owner) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, now, now, f"{HOSTNAME}:{os.getpid()}"),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (now - JOB_RETENTION_SECONDS,),
+        )
+        conn.execute("DELETE FROM captions WHERE created_at < ?", (now - CAPTION_CACHE_TTL_SECONDS,))
+        return job_id
+
+    def reap_stale_jobs(self):
+        """Fail queued or running jobs whose worker process is gone, so pollers stop waiting on them."""
+        conn = self._connect()
+        now = time.time()
+        rows = conn.execute("SELECT job_id, owner, updated_at FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        reaped = 0
+        for job_id, owner, updated_at in rows:
+            if updated_at < now - JOB_STALE_SECONDS or not _owner_alive(owner):
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?"
+                    " WHERE job_id = ? AND status IN ('queued', 'running')",
+                    ("The worker running this job stopped before it finished.", now, job_id),
+                )
+                reaped += cursor.rowcount
+        return reaped
+
+    def update_job(self, job_id, status, result=None, error=None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def get_job(self, job_id):
+        row = self._connect().execute(
+            "SELECT status, result, error, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, result, error, created_at, updated_at = row
+        job = {"job_id": job_id, "status": status, "created_at": created_at, "updated_at": updated_at}
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+
+# Function to tell whether the worker process that owns a job is still running
+def _owner_alive(owner):
+    """Owners on other hosts can't be checked and count as alive; the staleness timeout covers them."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != HOSTNAME or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024
+
+store = ResultStore(CAPTION_SERVICE_DB)
+store.reap_stale_jobs()
+executor = ThreadPoolExecutor(max_workers=CAPTION_WORKERS, thread_name_prefix="caption")
+# Jobs get their own pool so a batch job waiting on `executor` can't starve it
+job_executor = ThreadPoolExecutor(max_workers=CAPTION_WORKERS, thread_name_prefix="caption-job")
+
+
+# Function to load the image bytes described by one request item
+def load_item_image(item, deadline):
+    """Return a ModelImage for an item with image_url or image_base64 (or uploaded bytes)."""
+    try:
+        if item.get("image_bytes") is not None:
+            data = item["image_bytes"]
+        elif item.get("image_base64"):
+            data = base64.b64decode(item["image_base64"], validate=True)
+        elif item.get("image_url"):
+            data = fetch_image_bytes(item["image_url"], deadline=deadline)
+        else:
+            raise CaptionError("Provide image_url, image_base64 or an uploaded image.")
+        return prepare_model_image(data)
+    except CaptionError:
+        raise
+    except DeadlineExceeded as e:
+        raise CaptionError(str(e), status=504)
+    except ValueError as e:
+        raise CaptionError(f"Not a supported image: {e}")
+    except Exception as e:
+        raise CaptionError(f"Could not load image: {e}", status=502)
+
+
+# Function to caption one request item, going through the shared result cache
+def caption_item(item, batch_deadline=None):
+    """Return the caption result for one item: {"description", "issues", "image_digest", "cached"}."""
+    image_type = item.get("image_type")
+    if image_type not in IMAGE_TYPES:
+        raise CaptionError(f"image_type must be one of: {', '.join(IMAGE_TYPES)}.")
+
+    # One budget for the download and every model call made for this item, never past the batch's
+    seconds = REQUEST_DEADLINE_SECONDS
+    if batch_deadline is not None:
+        if batch_deadline.expired:
+            raise CaptionError(
+                f"The batch exceeded its {batch_deadline.seconds:g}s deadline before this item started.", status=504
+            )
+        seconds = min(seconds, batch_deadline.remaining())
+    deadline = Deadline(seconds)
+    image = load_item_image(item, deadline)
+    prompt = get_prompt(image_type)
+    cache_key = hashlib.sha256(f"{image.digest}\0{image_type}\0{prompt}".encode()).hexdigest()
+
+    cached = None if item.get("refresh") else store.get_caption(cache_key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    model_image, trim_report = image, None
+    if image_type == "Product Image":
+        # Crop the plain background so the model only receives the product
+        model_image, trim_report = trim_model_image(image)
+
+    caption = generate_caption(model_image, prompt, deadline)
+    if caption is None:
+        if deadline.expired:
+            budget = batch_deadline if batch_deadline is not None and batch_deadline.expired else deadline
+            raise CaptionError(f"Captioning exceeded its {budget.seconds:g}s deadline.", status=504)
+        raise CaptionError("Usage limit reached or an error occurred.", status=502)
+
+    annotation_id = get_annotation_store().add(
+        image.digest, image_type, caption.raw_text, url=item.get("image_url"), sku=item.get("sku"),
+        model=caption.tier, prompt=prompt, repaired_output=caption.text,
+    )
+    result = {
+        "annotation_id": annotation_id,
+        "image_type": image_type,
+        "image_digest": image.digest,
+        "model": caption.tier,
+        "description": caption.text,
+        "issues": caption.validation.issues,
+    }
+    if trim_report is not None:
+        result["trim"] = trim_report.as_dict()
+    # Failed captions are returned but not cached, so the next request tries again
+    if not result["issues"]:
+        store.put_caption(cache_key, result)
+    return dict(result, cached=False)
+
+
+def caption_batch(items, deadline=None):
+    """Caption items concurrently within one deadline; each entry is either a result or {"error", "status"}."""
+    deadline = deadline or Deadline(BATCH_DEADLINE_SECONDS)
+
+    def run(item):
+        try:
+            return caption_item(item, deadline)
+        except CaptionError as e:
+            return {"error": str(e), "status": e.status}
+
+    return list(executor.map(run, items))
+
+
+def run_job(job_id, payload):
+    store.update_job(job_id, "running")
+    try:
+        if "items" in payload:
+            result = {"items": caption_batch(payload["items"])}
+        else:
+            result = caption_item(payload)
+        store.update_job(job_id, "done", result=result)
+    except CaptionError as e:
+        store.update_job(job_id, "failed", error=str(e))
+    except Exception as e:
+        store.update_job(job_id, "failed", error=f"Unexpected error: {e}")
+
+
+def _request_payload():
+    """Read one item from JSON or a multipart upload."""
+    if request.files:
+        upload = request.files.get("image")
+        if upload is None:
+            raise CaptionError("Multipart requests must include an 'image' file.")
+        return {
+            "image_bytes": upload.read(),
+            "image_type": request.form.get("image_type"),
+            "sku": request.form.get("sku"),
+            "refresh": request.form.get("refresh", "").lower() in ("1", "true", "yes"),
+        }
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        raise CaptionError("Request body must be a JSON object.")
+    return payload
+
+
+def _batch_items(payload):
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        raise CaptionError("'items' must be a non-empty list.")
+    if len(items) > MAX_BATCH_SIZE:
+        raise CaptionError(f"At most {MAX_BATCH_SIZE} items per batch.")
+    if not all(isinstance(item, dict) for item in items):
+        raise CaptionError("Every item must be a JSON object.")
+    return items
+
+
+@app.before_request
+def check_token():
+    if request.endpoint == "healthz":
+        return None
+    if CAPTION_SERVICE_TOKEN:
+        if request.headers.get("Authorization") != f"Bearer {CAPTION_SERVICE_TOKEN}":
+            return jsonify({"error": "Unauthorized"}), 401
+    elif request.remote_addr not in ("127.0.0.1", "::1"):
+        # No token configured: never serve the model to other machines
+        return jsonify({"error": "Set CAPTION_SERVICE_TOKEN to accept remote requests."}), 403
+
+
+@app.errorhandler(CaptionError)
+def handle_caption_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+@app.post("/v1/captions")
+def create_caption():
+    return jsonify(caption_item(_request_payload()))
+
+
+@app.post("/v1/captions/batch")
+def create_caption_batch():
+    # The batch's budget starts when the request arrives, not when each item reaches a worker
+    deadline = Deadline(BATCH_DEADLINE_SECONDS)
+    return jsonify({"items": caption_batch(_batch_items(_request_payload()), deadline)})
+
+
+@app.post("/v1/jobs")
+def submit_job():
+    payload = _request_payload()
+    if "items" in payload:
+        payload = {"items": _batch_items(payload)}
+    job_id = store.create_job()
+    job_executor.submit(run_job, job_id, payload)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/v1/jobs/{job_id}"}), 202
+
+
+@app.get("/v1/jobs/<job_id>")
+def get_job(job_id):
+    store.reap_stale_jobs()
+    job = store.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.get("/healthz")
+def healthz():
+    return jsonify({"status": "ok", "memory": image_memory.report(), "cascade": cascade.stats()})
+
+
+if __name__ == "__main__":
+    host = os.getenv("CAPTION_SERVICE_HOST", "0.0.0.0" if CAPTION_SERVICE_TOKEN else "127.0.0.1")
+    app.run(host=host, port=int(os.getenv("PORT", "8000")), threaded=True)
@@ -0,0 +1,177 @@
+import re
+
+# Limits taken from the "Short Description" rules in get_prompt
+SHORT_MIN_WORDS = 8
+SHORT_MAX_WORDS = 15
+
+# Promotional and emotional words the prompts tell the model to avoid
+FORBIDDEN_WORDS = {
+    # Promotional
+    "amazing", "beautiful", "breathtaking", "elegant", "exquisite",
+    "fabulous", "flawless", "gorgeous", "luxurious", "must-have", "perfect",
+    "premium", "spectacular", "stunning", "stylish", "superb", "trendy",
+    # Emotional
+    "cheerful", "confident", "delighted", "excited", "happy",
+    "joyful", "lonely", "peaceful", "sad", "serene", "upset",
+}
+
+# Matches "**Short Description:**", "## Long Description", "Short Description of the Lifestyle Image:",
+# the prompt's own "**For the Short Description:**", and list items like "1. **Short Description:**"
+_SECTION_RE = re.compile(
+    r"^[ \t#*_>-]*(?:(?:\d+[.)]|[+\u2022])[ \t]*)?[ \t#*_]*(?:for\s+the\s+)?(short|long)\s+description\b[^\n:]*:?[*_ \t]*",
+    re.IGNORECASE | re.MULTILINE,
+)
+_WORD_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9'-]*")
+
+
+class ValidationResult:
+    """Outcome of validating a generated short + long description."""
+
+    def __init__(self, short_issues, long_issues):
+        self.short_issues = short_issues
+        self.long_issues = long_issues
+
+    @property
+    def ok(self):
+        return not self.short_issues and not self.long_issues
+
+    @property
+    def only_short_failed(self):
+        """True when the long description is fine and only the short one needs fixing."""
+        return bool(self.short_issues) and not self.long_issues
+
+    @property
+    def issues(self):
+        return self.short_issues + self.long_issues
+
+
+# Function to split model output into its short and long description sections
+def split_descriptions(text):
+    """Return (short, long) section bodies, using None for a missing section."""
+    sections = {}
+    matches = list(_SECTION_RE.finditer(text or ""))
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        kind = match.group(1).lower()
+        if kind not in sections:
+            sections[kind] = (match.end(), end)
+    bodies = {}
+    for kind, (start, end) in sections.items():
+        bodies[kind] = text[start:end].strip().strip("*_").strip()
+    return bodies.get("short"), bodies.get("long")
+
+
+def count_words(text):
+    return len(_WORD_RE.findall(text or ""))
+
+
+def find_forbidden_words(text):
+    """Return the forbidden words used in the text, in order of first appearance."""
+    found = []
+    for word in _WORD_RE.findall(text or ""):
+        word = word.lower()
+        if word in FORBIDDEN_WORDS and word not in found:
+            found.append(word)
+    return found
+
+
+# Function to validate the structured output locally, without another model call
+def validate_descriptions(text, check_forbidden_words=True):
+    """Check section structure, short description length and, unless disabled, forbidden words."""
+    short, long = split_descriptions(text)
+    short_issues = []
+    long_issues = []
+
+    if not short:
+        short_issues.append("Short description is missing.")
+    else:
+        words = count_words(short)
+        if words < SHORT_MIN_WORDS or words > SHORT_MAX_WORDS:
+            short_issues.append(
+                f"Short description has {words} words (expected {SHORT_MIN_WORDS} to {SHORT_MAX_WORDS})."
+            )
+        forbidden = find_forbidden_words(short) if check_forbidden_words else []
+        if forbidden:
+            short_issues.append(f"Short description uses forbidden words: {', '.join(forbidden)}.")
+
+    if not long:
+        long_issues.append("Long description is missing.")
+    else:
+        forbidden = find_forbidden_words(long) if check_forbidden_words else []
+        if forbidden:
+            long_issues.append(f"Long description uses forbidden words: {', '.join(forbidden)}.")
+
+    return ValidationResult(short_issues, long_issues)
+
+
+# Function to validate only what the model cascade escalates on
+def validate_structure(text):
+    """Check section structure, short description length and a non-empty long description.
+
+    Word choice is left to validate_descriptions: a forbidden word is not worth a call to a larger model.
+    """
+    return validate_descriptions(text, check_forbidden_words=False)
+
+
+# Function to build the text-only prompt that rewrites just the short description
+def get_short_description_fix_prompt(short, long, issues):
+    """Return a prompt asking for a corrected short description based on the long one."""
+    return (
+        "Rewrite the short description of an image so it follows the rules below. "
+        "Use only the information in the long description; do not invent details.\n\n"
+        f"- Keep it between {SHORT_MIN_WORDS} and {SHORT_MAX_WORDS} words.\n"
+        "- Focus on the object's identity, shape, function, material, and color.\n"
+        "- Avoid promotional language and words describing feelings or emotions.\n"
+        "- Reply with the short description only, on a single line, without a heading.\n\n"
+        f"Problems with the current short description: {' '.join(issues)}\n\n"
+        f"Current short description: {short or '(missing)'}\n\n"
+        f"Long description: {long}"
+    )
+
+
+def replace_short_description(text, new_short):
+    """Swap the body of the short description section, keeping the rest of the text intact."""
+    matches = list(_SECTION_RE.finditer(text))
+    for index, match in enumerate(matches):
+        if match.group(1).lower() == "short":
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+            # Keep the body where it was: on the heading's line or on the line below it
+            head = text[:match.end()]
+            if text[match.end():match.end() + 1] == "\n":
+                head += "\n"
+            elif not head.endswith((" ", "\t")):
+                head += " "
+            return head + new_short + "\n\n" + text[end:].lstrip("\n")
+    # No short section at all: put one in front of the existing output
+    return f"**Short Description:** {new_short}\n\n{text.lstrip()}"
+
+
+# Function to fix only the short description when it is the only part failing validation
+def repair_descriptions(text, model, request_options=None):
+    """Validate the output and, if the short description fails, fix it with a small text-only request.
+
+    The fix is written from the long description, so nothing is sent when that is missing.
+    Returns the (possibly repaired) text and the validation result for it.
+    """
+    result = validate_descriptions(text)
+    short, long = split_descriptions(text)
+    if not result.short_issues or not long:
+        return text, result
+
+    prompt = get_short_description_fix_prompt(short, long, result.short_issues)
+    try:
+        if request_options:
+            response = model.generate_content(prompt, request_options=request_options)
+        else:
+            response = model.generate_content(prompt)
+        new_short = response.candidates[0].content.parts[0].text.strip().strip('"').strip()
+    except Exception:
+        return text, result
+
+    # Keep only the first line in case the model adds anything after the sentence
+    new_short = new_short.splitlines()[0].strip() if new_short else ""
+    if not new_short:
+        return text, result
+
+    repaired = replace_short_description(text, new_short)
+    return repaired, validate_descriptions(repaired)
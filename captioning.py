@@ -0,0 +1,92 @@
+"""Captioning shared by the Streamlit apps and the HTTP caption service.
+
+Importing this module configures the Gemini client and builds the model cascade,
+without pulling in Streamlit.
+"""
+import os
+import google.generativeai as genai
+from dotenv import load_dotenv
+from model_cascade import create_default_cascade
+
+# Load environment variables
+load_dotenv()
+
+# Google API Configuration
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+genai.configure(api_key=GOOGLE_API_KEY)
+
+# Flash answers first; pro is only called when flash output fails validation
+cascade = create_default_cascade()
+
+# Returned by generate_image_descriptions when the model call fails
+GENERATION_ERROR_MESSAGE = "Usage limit reached or an error occurred."
+
+
+# Function to generate a caption through the model cascade
+def generate_caption(image, prompt, deadline=None):
+    """Send image and prompt through the model cascade; returns a CascadeResult, or None if it failed."""
+    try:
+        return cascade.generate([prompt, image.as_part()], deadline=deadline)
+    except Exception as e:
+        return None
+
+
+# Function to generate image descriptions using LLM
+def generate_image_descriptions(image, prompt, deadline=None):
+    """Send image and prompt to LLM to get descriptions, giving up when the deadline passes."""
+    result = generate_caption(image, prompt, deadline)
+    return result.text if result else GENERATION_ERROR_MESSAGE
+
+
+# Function to get prompt based on image type
+def get_prompt(image_type):
+    """Return the appropriate prompt based on the image type."""
+    if image_type == "Product Image":
+        return (           
+           """**For the Short Description:**
+
+            - Emphasize simplicity and conciseness.
+            - Focus on the essential elements: the object's identity, shape (if applicable), function, material, and color.
+            - Ensure you keep the description between 8 to 15 words but ensure is under 15 words.
+            - Avoid excessive detail and focus on the core attributes.
+            - Example: "Cordless vacuum, light blue base, silver-gold handle."
+
+            **For the Long Description:**
+
+            - Provide comprehensive details, including color, material, brand or manufacturer, and additional features.
+            - Describe the background of the image including any artistic or design elements.
+            - Include any text present on the image or the product itself.
+            - Avoid promotional language and focus on objective description for machine learning understanding.
+            - Limit details to those observable in the image, excluding information only available from product descriptions.
+            - Any positioning should be based on your perspective looking at the image e.g. left, right
+            - Ensure you pay attention to the position of the product in the image and include the detail in the decription.
+            - Finally, ensure you include every details in the image.
+            """
+        )
+    elif image_type == "Lifestyle Image":
+        return ("""  For the Short Description of the Lifestyle Image:
+
+                    Emphasize simplicity and conciseness.
+                    Focus on key elements: object, shape, function, material, and color.
+                    Ensure you keep the description between 8 to 15 words but ensure is under 15 words.
+                    Avoid excessive detail and focus on core attributes.
+                    Example: "Person using a blue laptop at a cafe."
+                    For the Long Description:
+
+                    Provide comprehensive details, including colors, materials, brands, and features.
+                    Describe the background if it contains design elements.
+                    Include any text present on the image or the product.
+                    Avoid promotional language and focus on objective description for machine learning.
+                    Limit details to those observable in the image, excluding information from product descriptions.
+                    Use a consistent perspective (e.g., left, right) for positioning.
+                    Avoid describing feelings or emotions tied to the image.
+                    Focus on positions like left, right, centered, etc.
+                    Provide detailed descriptions of the person using the product, including color, hairstyle, posture, etc.
+                    Ensure the description fully captures the lifestyle context of the image.
+                    Any positioning should be based on your perspective looking at the image e.g. left, right
+                    - Ensure you pay attention to the position of the product in the image and include the detail in the decription 
+                    - if the person in the image is holding any object consider the positioning of the object held interm of wheher rigth or left.
+                    - Finally, ensure you include every details in the image.
+                 """
+        )
+    return ""
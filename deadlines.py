@@ -0,0 +1,186 @@
+"""End-to-end deadlines and hedged requests for slow external calls.
+
+A Deadline is created once per user request and passed down, so the download, the model
+call and any escalation all share one time budget. HedgedCaller runs a call on a worker
+thread, waits at most until the deadline, and, when enabled, sends a duplicate request once
+the first has been outstanding longer than a chosen latency percentile; the first success wins.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from profiling import profile_worker
+
+# Default budget for one caption request (download + model calls), in seconds
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "90"))
+
+# Percentile of observed latency after which a duplicate model call is sent; unset disables hedging
+MODEL_HEDGE_PERCENTILE = os.getenv("MODEL_HEDGE_PERCENTILE")
+
+# Latency samples needed before hedging starts, so early noise doesn't trigger duplicates
+HEDGE_MIN_SAMPLES = 20
+
+# While hedging, each attempt's transport timeout is this multiple of the observed p99 latency
+HEDGE_ATTEMPT_TIMEOUT_FACTOR = 3
+
+# Worker threads per HedgedCaller (one per tier); a running attempt holds one until it returns
+MODEL_CALL_WORKERS = int(os.getenv("MODEL_CALL_WORKERS", "16"))
+
+# Latency samples kept for the percentile figures
+LATENCY_WINDOW = 1000
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out."""
+
+
+class Deadline:
+    """A point in time by which a request must finish."""
+
+    def __init__(self, seconds=REQUEST_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, what="request"):
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self.expired:
+            raise DeadlineExceeded(f"{what} exceeded its {self.seconds:g}s deadline")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class HedgedCaller:
+    """Run calls under a deadline, optionally hedging slow ones with a duplicate request.
+
+    A running attempt can't be cancelled, so an attempt that loses the race keeps going until
+    its own transport timeout ends it. While hedging is on, each attempt therefore gets a
+    timeout of HEDGE_ATTEMPT_TIMEOUT_FACTOR x the observed p99 latency (never more than the
+    deadline), instead of the whole remaining deadline; that bounds both the duplicate spend
+    and how long a loser holds one of the worker threads.
+    """
+
+    def __init__(self, hedge_percentile=None, max_workers=MODEL_CALL_WORKERS, name="hedged"):
+        self.hedge_percentile = float(hedge_percentile) if hedge_percentile else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._queue_waits = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def _latency_percentile(self, pct):
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return percentile(sorted(self._latencies), pct)
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None when hedging is off or there is too little data."""
+        if self.hedge_percentile is None:
+            return None
+        return self._latency_percentile(self.hedge_percentile)
+
+    def attempt_timeout(self, deadline):
+        """Transport timeout for one attempt: bounded by the p99 latency while hedging, else the deadline."""
+        remaining = deadline.remaining()
+        if self.hedge_percentile is None:
+            return remaining
+        p99 = self._latency_percentile(99)
+        if p99 is None:
+            return remaining
+        return min(remaining, p99 * HEDGE_ATTEMPT_TIMEOUT_FACTOR)
+
+    def _submit(self, fn, deadline):
+        submitted = time.monotonic()
+        timeout = self.attempt_timeout(deadline)
+
+        def attempt():
+            # Latency is measured from when the attempt starts running, not from when it was queued
+            started = time.monotonic()
+            with self._lock:
+                self._queue_waits.append(started - submitted)
+            result = fn(min(timeout, deadline.remaining()))
+            return result, time.monotonic() - started
+
+        return self._executor.submit(profile_worker(attempt))
+
+    def call(self, fn, deadline):
+        """Return fn(timeout_seconds) from the first attempt to succeed before the deadline.
+
+        `fn` must pass the timeout on as its own transport timeout; that is what ends a losing
+        or abandoned attempt, since running threads can't be killed. Losers still queued are
+        cancelled; running ones finish or time out in the background.
+        """
+        deadline.check()
+        with self._lock:
+            self.calls += 1
+
+        primary = self._submit(fn, deadline)
+        attempts = [primary]
+        delay = self.hedge_delay()
+        if delay is not None and delay < deadline.remaining():
+            done, _ = wait(attempts, timeout=delay)
+            if not done:
+                attempts.append(self._submit(fn, deadline))
+                with self._lock:
+                    self.hedges += 1
+
+        error = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    result, latency = future.result()
+                    self._record(latency, won_by_hedge=future is not primary)
+                    return result
+                error = future.exception()
+
+        if pending:
+            for loser in pending:
+                loser.cancel()
+            with self._lock:
+                self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"model call exceeded its {deadline.seconds:g}s deadline")
+        raise error
+
+    def _record(self, latency, won_by_hedge):
+        with self._lock:
+            self._latencies.append(latency)
+            if won_by_hedge:
+                self.hedge_wins += 1
+
+    def stats(self):
+        """Hedging counters and queue wait. The per-attempt latencies only drive hedge_delay and
+        attempt_timeout; callers report request latency from their own end-to-end timings."""
+        with self._lock:
+            queue_waits = sorted(self._queue_waits)
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "deadline_exceeded": self.deadline_exceeded,
+                "queue_wait_p99": percentile(queue_waits, 99),
+            }
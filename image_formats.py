@@ -0,0 +1,289 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, features
+
+# Formats Gemini accepts as-is; everything else is transcoded once and cached
+MODEL_NATIVE_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+# Images larger than this on their longest side are downscaled before upload
+MODEL_MAX_SIDE = int(os.getenv("MODEL_MAX_SIDE", "3072"))
+
+# Preview size for st.image (the apps display at width=300, doubled for high-DPI screens)
+THUMBNAIL_SIDE = 600
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+    "AVIF": "image/avif",
+    "HEIF": "image/heif",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+}
+
+EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "GIF": "gif",
+    "WEBP": "webp",
+    "AVIF": "avif",
+    "HEIF": "heic",
+    "BMP": "bmp",
+    "TIFF": "tiff",
+}
+
+_AVIF_BRANDS = {b"avif", b"avis"}
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+# Formats PIL can decode once _register_plugins has run, and what to install for the others
+_plugin_decoders = None
+_plugin_lock = threading.Lock()
+MISSING_DECODER_MESSAGES = {
+    "AVIF": "AVIF images need Pillow 11.2 or newer built with AVIF support, or the pillow-avif-plugin package.",
+    "HEIF": "HEIF images need the pillow-heif package.",
+}
+
+
+# Function to detect the image format from its leading bytes
+def sniff_image_format(data):
+    """Return the PIL format name for the image bytes, or None if they are not a known image."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[4:8] == b"ftyp":
+        # ISO base media file: the major brand plus the compatible brands list tell AVIF from HEIF
+        box_size = int.from_bytes(data[:4], "big")
+        brands = {data[8:12]}
+        brands.update(data[i:i + 4] for i in range(16, min(box_size, len(data)) - 3, 4))
+        if brands & _AVIF_BRANDS:
+            return "AVIF"
+        if brands & _HEIF_BRANDS:
+            return "HEIF"
+        return None
+    if data[:2] == b"BM":
+        return "BMP"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    return None
+
+
+def _register_plugins():
+    """Load the AVIF/HEIF decoder plugins once and return {format: decodable}."""
+    global _plugin_decoders
+    with _plugin_lock:
+        if _plugin_decoders is not None:
+            return _plugin_decoders
+        # Pillow 11.2+ decodes AVIF itself when built with libavif; older releases need the plugin
+        avif = "avif" in features.modules and features.check_module("avif")
+        if not avif:
+            try:
+                import pillow_avif  # noqa: F401  (registers the AVIF plugin with PIL)
+                avif = True
+            except ImportError:
+                pass
+        heif = False
+        try:
+            from pillow_heif import register_heif_opener
+            register_heif_opener()
+            heif = True
+        except ImportError:
+            pass
+        _plugin_decoders = {"AVIF": avif, "HEIF": heif}
+        return _plugin_decoders
+
+
+# Function to open image bytes with PIL, using the decoder plugins where needed
+def open_image_bytes(data, image_format=None):
+    """Open image bytes as a PIL image, raising ValueError for data that is not a supported image."""
+    image_format = image_format or sniff_image_format(data)
+    if image_format is None:
+        raise ValueError("Data is not a recognised image format.")
+    if image_format in ("AVIF", "HEIF") and not _register_plugins()[image_format]:
+        raise ValueError(MISSING_DECODER_MESSAGES[image_format])
+    return Image.open(io.BytesIO(data))
+
+
+class ModelImage:
+    """Image bytes in a format the model accepts, plus the metadata the apps display."""
+
+    def __init__(self, data, mime_type, width, height, source_format, digest):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.source_format = source_format
+        self.digest = digest
+        self._thumbnails = {}
+
+    def as_part(self):
+        """Return the inline blob passed to model.generate_content."""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+    def to_pil(self):
+        return Image.open(io.BytesIO(self.data))
+
+    @property
+    def nbytes(self):
+        """Bytes held by this image: the model payload plus any previews built from it."""
+        return len(self.data) + sum(len(preview) for preview in self._thumbnails.values())
+
+    def thumbnail(self, max_side=THUMBNAIL_SIDE):
+        """Return JPEG preview bytes no larger than max_side, built once per cached image."""
+        if max_side not in self._thumbnails:
+            with self.to_pil() as image:
+                if image.format == "JPEG":
+                    image.draft("RGB", (max_side, max_side))
+                image.thumbnail((max_side, max_side))
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, format="JPEG", quality=85)
+            self._thumbnails[max_side] = buffer.getvalue()
+            # The preview lives as long as the cached image, so it counts against the cache budget
+            transcode_cache.remeasure(self.digest, self)
+        return self._thumbnails[max_side]
+
+
+class TranscodeCache:
+    """Thread-safe LRU of model-ready images (with their previews), bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._sizes[key] = entry.nbytes
+            self._size += self._sizes[key]
+            self._evict()
+
+    def remeasure(self, key, entry):
+        """Update the size of a cached entry that has grown (e.g. a preview was added)."""
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return
+            size = entry.nbytes
+            self._size += size - self._sizes[key]
+            self._sizes[key] = size
+            self._evict()
+
+    def discard(self, key):
+        """Drop an entry; returns True if it was cached."""
+        with self._lock:
+            return self._remove(key)
+
+    def _remove(self, key):
+        if key not in self._entries:
+            return False
+        del self._entries[key]
+        self._size -= self._sizes.pop(key)
+        return True
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+transcode_cache = TranscodeCache(int(os.getenv("TRANSCODE_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def _transcode(data, image_format, digest):
+    """Decode once and re-encode as JPEG (opaque) or PNG (with transparency)."""
+    with open_image_bytes(data, image_format) as image:
+        if image.format == "JPEG":
+            # Let libjpeg decode at a reduced scale when we are going to downscale anyway
+            image.draft("RGB", (MODEL_MAX_SIDE, MODEL_MAX_SIDE))
+        image.load()
+        if max(image.size) > MODEL_MAX_SIDE:
+            image.thumbnail((MODEL_MAX_SIDE, MODEL_MAX_SIDE))
+        model_image = encode_model_image(image, image_format, digest)
+        # Trim now, from the source pixels, rather than later from this lossy re-encode
+        from background_trim import trim_decoded_image
+        trim_decoded_image(image, model_image)
+        return model_image
+
+
+# Function to encode a decoded PIL image as model-ready bytes
+def encode_model_image(image, source_format, digest=None, keep_webp=False):
+    """Encode as JPEG (opaque) or PNG (with transparency), or WebP when keep_webp is set.
+
+    digest defaults to the hash of the new bytes.
+    """
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    buffer = io.BytesIO()
+    if keep_webp:
+        image.convert("RGBA" if has_alpha else "RGB").save(buffer, format="WEBP", quality=90)
+        mime_type = "image/webp"
+    elif has_alpha:
+        image.convert("RGBA").save(buffer, format="PNG", optimize=True)
+        mime_type = "image/png"
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=90)
+        mime_type = "image/jpeg"
+    data = buffer.getvalue()
+    return ModelImage(data, mime_type, image.width, image.height, source_format, digest or hashlib.sha256(data).hexdigest())
+
+
+# Function to turn any supported image into model-ready bytes, transcoding at most once per asset
+def prepare_model_image(data):
+    """Return a cached ModelImage for the raw image bytes.
+
+    JPEG, PNG and WebP within the size limit are passed through without decoding pixels;
+    other formats (AVIF, HEIF, GIF, ...) are transcoded once and served from the cache afterwards.
+    """
+    image_format = sniff_image_format(data)
+    if image_format is None:
+        raise ValueError("Data is not a recognised image format.")
+
+    digest = hashlib.sha256(data).hexdigest()
+    cached = transcode_cache.get(digest)
+    if cached is not None:
+        return cached
+
+    if image_format in MODEL_NATIVE_FORMATS:
+        # Reading the header is enough to get the size; pixels are not decoded
+        with open_image_bytes(data, image_format) as image:
+            width, height = image.size
+        if max(width, height) <= MODEL_MAX_SIDE:
+            model_image = ModelImage(data, MIME_TYPES[image_format], width, height, image_format, digest)
+            transcode_cache.put(digest, model_image)
+            return model_image
+
+    model_image = _transcode(data, image_format, digest)
+    transcode_cache.put(digest, model_image)
+    return model_image
@@ -0,0 +1,139 @@
+"""Process-wide bookkeeping of the images held for Streamlit sessions.
+
+Decoded pixels are never kept: every decode (thumbnails, transcodes, trims) happens inside a
+`with` block and is closed straight away. What stays in memory is compressed bytes, the
+model-ready images and their JPEG previews, held in image_formats.transcode_cache and bounded
+by TRANSCODE_CACHE_MB. This manager records which image each session shows, so images only
+ended sessions were showing are dropped from that cache at once instead of waiting for LRU
+eviction, and reports the figures.
+"""
+import gc
+import os
+import resource
+import threading
+import time
+
+from image_formats import transcode_cache
+
+# Sessions that haven't rerun for this long are treated as ended
+SESSION_IDLE_SECONDS = int(os.getenv("IMAGE_SESSION_IDLE_SECONDS", "3600"))
+
+# How often (at most) touch() looks for ended sessions
+SWEEP_INTERVAL_SECONDS = 60
+
+
+def current_rss_bytes():
+    """Resident set size of this process, falling back to peak RSS where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ImageMemoryManager:
+    """Tracks the image each session shows per slot and releases images of ended sessions."""
+
+    def __init__(self, cache=transcode_cache):
+        self.cache = cache
+        self._sessions = {}
+        self._last_seen = {}
+        self._last_sweep = 0.0
+        self._lock = threading.RLock()
+        self.released = 0
+
+    # Session bookkeeping
+    def touch(self, session_id, active_sessions=None):
+        """Record that a session is alive and periodically release sessions that have ended.
+
+        `active_sessions` is an optional callable returning the connected session ids; it is
+        only called when a sweep is due.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._last_seen[session_id] = now
+            self._sessions.setdefault(session_id, {})
+            if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+                return
+            self._last_sweep = now
+        self.sweep(active_sessions() if active_sessions else None)
+
+    def register(self, session_id, slot, model_image):
+        """Note that a session shows model_image in a slot (e.g. "product_url"), replacing the previous one."""
+        with self._lock:
+            slots = self._sessions.setdefault(session_id, {})
+            previous = slots.get(slot)
+            slots[slot] = model_image.digest
+            self._last_seen[session_id] = time.monotonic()
+            if previous and previous != model_image.digest:
+                self._drop_if_unreferenced(previous)
+
+    def release_session(self, session_id):
+        """Forget a session and drop cached images only it was showing."""
+        with self._lock:
+            slots = self._sessions.pop(session_id, {})
+            self._last_seen.pop(session_id, None)
+            for digest in slots.values():
+                self._drop_if_unreferenced(digest)
+
+    def sweep(self, active_session_ids=None):
+        """Release sessions that are no longer active or have been idle too long."""
+        cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+        with self._lock:
+            ended = [
+                session_id for session_id, seen in self._last_seen.items()
+                if seen < cutoff or (active_session_ids is not None and session_id not in active_session_ids)
+            ]
+        for session_id in ended:
+            self.release_session(session_id)
+        return ended
+
+    def _drop_if_unreferenced(self, digest):
+        if any(digest in slots.values() for slots in self._sessions.values()):
+            return
+        if self.cache.discard(digest):
+            self.released += 1
+
+    def report(self, count_objects=False):
+        """Return a snapshot of memory use; count_objects walks the GC heap and is slower."""
+        with self._lock:
+            snapshot = {
+                "rss_bytes": current_rss_bytes(),
+                "sessions": len(self._sessions),
+                "session_images": sum(len(slots) for slots in self._sessions.values()),
+                "released_images": self.released,
+                "cache_images": len(self.cache),
+                "cache_bytes": self.cache.size_bytes,
+                "cache_budget_bytes": self.cache.max_bytes,
+                "cache_evictions": self.cache.evictions,
+            }
+        if count_objects:
+            from PIL import Image
+            snapshot["pil_image_objects"] = sum(1 for obj in gc.get_objects() if isinstance(obj, Image.Image))
+        return snapshot
+
+
+image_memory = ImageMemoryManager()
+
+
+# Function to get the id of the Streamlit session running this script
+def streamlit_session_id():
+    """Return the current session id, or None outside a Streamlit script run."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+
+# Function to list the sessions still connected to this Streamlit server
+def active_streamlit_session_ids():
+    """Return the set of connected session ids, or None if the runtime can't be queried."""
+    try:
+        # The session manager is not public API; fall back to idle-time expiry if it changes
+        from streamlit.runtime import get_instance
+        return {info.session.id for info in get_instance()._session_mgr.list_active_sessions()}
+    except Exception:
+        return None
@@ -0,0 +1,272 @@
+"""Concurrent-session load test for the Streamlit caption apps.
+
+Drives N simulated editors through the real app script with Streamlit's AppTest API:
+login, URL entry, generate, edit. Images come from a local HTTP server and the Gemini
+model is replaced by a fake with configurable latency, so no network or API key is needed.
+Captions go to a throwaway annotation database, never the editors' ANNOTATION_DB.
+
+Example:
+    python loadtest.py --app main_software.py --sessions 1,5,10,20 --model-latency 1.5
+"""
+import argparse
+import functools
+import http.server
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+import streamlit
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test as _app_test
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+from image_memory import current_rss_bytes, image_memory
+from model_cascade import StandInResponse
+
+LOAD_TEST_PASSWORD = "load-test"
+
+VALID_CAPTION = (
+    "**Short Description:** Sleeveless long printed dress with round neckline on white background.\n\n"
+    "**Long Description:** A sleeveless long dress with a printed pattern, shown centered on a plain "
+    "white background. The dress has a round neckline and falls to the ankle."
+)
+FIXED_SHORT = "Sleeveless long printed dress with round neckline on white background."
+ACTIONS = ("login", "enter_url", "generate", "edit", "idle_rerun")
+
+# allow_concurrent_apptests patches private Streamlit internals; they were checked against this release
+TESTED_STREAMLIT_VERSION = "1.66"
+
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel that sleeps for a configurable latency."""
+
+    latency = 1.0
+    jitter = 0.2
+
+    def __init__(self, model_name=None, *args, **kwargs):
+        self.model_name = model_name
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        time.sleep(max(0.0, random.gauss(self.latency, self.latency * self.jitter)))
+        # Text-only requests are the short-description repair; image requests get a full caption
+        if isinstance(contents, str):
+            return StandInResponse(FIXED_SHORT)
+        return StandInResponse(VALID_CAPTION)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to serve a directory of images on a local port
+def start_image_server(directory):
+    """Start a threaded HTTP server for the directory and return it (use server.server_port)."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Function to let several AppTest instances run at once in this process
+def allow_concurrent_apptests():
+    """Make AppTest behave like one Streamlit server hosting many sessions.
+
+    AppTest installs a mock Runtime singleton for each run and resets it to None when the run
+    finishes, which breaks any other session still running. With a fallback, a session whose
+    mock was cleared by another thread keeps working against an equivalent shared mock.
+
+    AppTest also compiles the script on every run with a fresh ScriptCache, while a real
+    server compiles it once; concurrent ast.parse calls can crash on Python 3.11. Bytecode is
+    therefore compiled once under a lock and shared, as the server does.
+    """
+    hooks = {
+        "Runtime._instance": Runtime,
+        "ScriptCache.get_bytecode": ScriptCache,
+        "MagicMock": _app_test,
+        "MediaFileManager": _app_test,
+        "MemoryMediaFileStorage": _app_test,
+        "DataframeSourceManager": _app_test,
+        "MemoryCacheStorageManager": _app_test,
+    }
+    missing = [name for name, owner in hooks.items() if not hasattr(owner, name.rpartition(".")[2])]
+    if missing:
+        raise RuntimeError(
+            f"Streamlit {streamlit.__version__} lacks the AppTest internals this load test patches "
+            f"({', '.join(missing)}); install streamlit=={TESTED_STREAMLIT_VERSION}.*"
+        )
+    if not streamlit.__version__.startswith(TESTED_STREAMLIT_VERSION + "."):
+        print(f"Warning: the AppTest patches were checked against Streamlit {TESTED_STREAMLIT_VERSION}, not {streamlit.__version__}")
+
+    fallback = _app_test.MagicMock(spec=Runtime)
+    fallback.media_file_mgr = _app_test.MediaFileManager(_app_test.MemoryMediaFileStorage("/mock/media"))
+    fallback.dataframe_source_mgr = _app_test.DataframeSourceManager()
+    fallback.cache_storage_manager = _app_test.MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or fallback)
+
+    compile_lock = threading.Lock()
+    bytecode = {}
+    get_bytecode = ScriptCache.get_bytecode
+
+    def shared_get_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in bytecode:
+                bytecode[script_path] = get_bytecode(self, script_path)
+            return bytecode[script_path]
+
+    ScriptCache.get_bytecode = shared_get_bytecode
+
+
+def _find(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"Widget not found: {label}")
+
+
+def _timed(at, timings, action, fn):
+    start = time.perf_counter()
+    fn()
+    timings.append((action, time.perf_counter() - start))
+    if at.exception:
+        raise RuntimeError(f"App raised during {action}: {at.exception[0].value}")
+    # The apps catch most failures themselves and report them with st.error
+    if at.error:
+        raise RuntimeError(f"App showed an error during {action}: {at.error[0].value}")
+
+
+# Function to run one simulated editor through the app
+def run_session(app_path, image_urls, timeout):
+    """Login, enter a product URL, generate, edit the result and rerun; returns [(action, seconds)]."""
+    timings = []
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    at.run()
+
+    def login():
+        at.sidebar.text_input[0].input(LOAD_TEST_PASSWORD)
+        _find(at.sidebar.button, "Login").click().run()
+
+    def enter_url():
+        at.text_input(key="product_url").input(random.choice(image_urls)).run()
+
+    def generate():
+        _find(at.button, "Generate Product Description").click().run()
+
+    def edit():
+        area = _find(at.text_area, "Product Description")
+        area.input(area.value + " Edited.").run()
+
+    _timed(at, timings, "login", login)
+    _timed(at, timings, "enter_url", enter_url)
+    _timed(at, timings, "generate", generate)
+    if _find(at.text_area, "Product Description").value != VALID_CAPTION:
+        raise RuntimeError("Generate did not put the fake model's caption in the description")
+    _timed(at, timings, "edit", edit)
+    _timed(at, timings, "idle_rerun", at.run)
+    return timings
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+# Function to run one concurrency level and summarise it
+def run_level(app_path, image_urls, sessions, timeout):
+    """Run `sessions` editors concurrently and return throughput, latency and memory figures."""
+    start = time.perf_counter()
+    errors = 0
+    timings = []
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(run_session, app_path, image_urls, timeout) for _ in range(sessions)]
+        for future in futures:
+            try:
+                timings.extend(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"  session failed: {e}")
+    elapsed = time.perf_counter() - start
+
+    by_action = {action: [seconds for name, seconds in timings if name == action] for action in ACTIONS}
+    return {
+        "sessions": sessions,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(timings) / elapsed if elapsed else 0.0,
+        "latency": {
+            action: (percentile(values, 50), percentile(values, 95), percentile(values, 99))
+            for action, values in by_action.items()
+        },
+        "rss_bytes": current_rss_bytes(),
+        "memory": image_memory.report(),
+    }
+
+
+def print_level(result):
+    print(
+        f"\n== {result['sessions']} concurrent sessions: {result['throughput']:.2f} actions/s, "
+        f"{result['elapsed']:.1f}s total, {result['errors']} errors, "
+        f"RSS {result['rss_bytes'] / 1024 / 1024:.0f} MB, "
+        f"image cache {result['memory']['cache_images']} images / {result['memory']['cache_bytes'] / 1024:.0f} KB"
+    )
+    print(f"   {'action':<12} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for action, (p50, p95, p99) in result["latency"].items():
+        print(f"   {action:<12} {p50:>7.3f}s {p95:>7.3f}s {p99:>7.3f}s")
+    # An idle rerun is the fixed cost every widget interaction pays before any real work
+    print(f"   rerun cost (idle rerun p50): {result['latency']['idle_rerun'][0] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Streamlit caption apps with simulated editors.")
+    parser.add_argument("--app", default="main_software.py", help="App script to drive (main_software.py or TEST.py).")
+    parser.add_argument("--sessions", default="1,5,10,20", help="Comma-separated concurrency levels.")
+    parser.add_argument("--images", default="downloaded_images", help="Directory served by the local image server.")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="Mean fake model latency in seconds.")
+    parser.add_argument("--model-jitter", type=float, default=0.2, help="Latency standard deviation as a fraction of the mean.")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-rerun timeout in seconds.")
+    args = parser.parse_args()
+
+    # The apps read these at import time, so they must be in place before the first run
+    os.environ["APP_PASSWORD"] = LOAD_TEST_PASSWORD
+    os.environ.setdefault("GOOGLE_API_KEY", "load-test")
+    FakeGenerativeModel.latency = args.model_latency
+    FakeGenerativeModel.jitter = args.model_jitter
+    genai.GenerativeModel = FakeGenerativeModel
+    allow_concurrent_apptests()
+
+    server = start_image_server(args.images)
+    image_urls = [
+        f"http://127.0.0.1:{server.server_port}/{name}"
+        for name in sorted(os.listdir(args.images))
+    ]
+    if not image_urls:
+        parser.error(f"No images found in {args.images}")
+
+    # Keep the fake captions out of the editors' annotation store; read when the app first saves one
+    scratch_dir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["ANNOTATION_DB"] = os.path.join(scratch_dir, "annotations.sqlite3")
+
+    app_path = os.path.abspath(args.app)
+    print(f"Driving {args.app} with images from {args.images} and a {args.model_latency}s fake model")
+    try:
+        for sessions in (int(level) for level in args.sessions.split(",")):
+            print_level(run_level(app_path, image_urls, sessions, args.timeout))
+    finally:
+        server.shutdown()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
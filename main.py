@@ -1,9 +1,11 @@
 import streamlit as st
-from PIL import Image
-import io
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
+from deadlines import REQUEST_DEADLINE_SECONDS
+from background_trim import trim_model_image
+from image_formats import prepare_model_image
+from model_cascade import create_default_cascade
 
 # Load environment variables
 load_dotenv()
@@ -12,29 +14,23 @@ load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=GOOGLE_API_KEY)
 
-# Initialize the Gemini model
-model = genai.GenerativeModel("models/gemini-1.5-pro-002")
+# Initialize the Gemini models: flash first for captions, escalating to pro only when validation fails
+cascade = create_default_cascade()
+
+# Grammar correction keeps using the largest model in the cascade
+model = cascade.tiers[-1][1]
 
 # Function to generate image descriptions using LLM
 def generate_image_descriptions(image, prompt):
     try:
-        # Convert the image to a byte array (Blob)
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format=image.format)
-        img_byte_arr.seek(0)
-
-        # Prepare the input as content
+        # Send the cached model-ready bytes instead of re-saving with image.format
         contents = [
             prompt,
-            Image.open(img_byte_arr)
+            image.as_part()
         ]
 
-        # Generate response using the model
-        response = model.generate_content(contents)
-
-        # Extract the generated content text from the response
-        generated_text = response.candidates[0].content.parts[0].text
-        return generated_text
+        # Generate response through the model cascade
+        return cascade.generate(contents).text
     except Exception as e:
         return "Error: The image you uploaded is sensitive or the usage limit has been reached. Please try again later."
 
@@ -46,8 +42,8 @@ def correct_grammar(input_text, prompt):
             input_text
         ]
 
-        # Generate response using the model
-        response = model.generate_content(contents)
+        # Generate response using the model, bounded so a stuck call can't hang the page
+        response = model.generate_content(contents, request_options={"timeout": REQUEST_DEADLINE_SECONDS})
 
         # Extract the corrected text from the response
         corrected_text = response.candidates[0].content.parts[0].text
@@ -150,18 +146,28 @@ def main():
         image_type = st.selectbox("Select Image Type", ["Product Image", "Lifestyle Image"])
 
         # Upload image
-        uploaded_image = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png", "webp"])
+        uploaded_image = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png", "webp", "avif"])
 
         if uploaded_image:
-            # Display uploaded image
-            image = Image.open(uploaded_image)
-            st.image(image, caption='Uploaded Image', width=300)
+            # Detect the format from the bytes and transcode once if the model can't take it directly
+            try:
+                image = prepare_model_image(uploaded_image.getvalue())
+            except Exception:
+                image = None
+                st.error("Image not supported. Please upload a JPEG, PNG, WebP or AVIF image.")
+
+        if uploaded_image and image:
+            st.image(image.data, caption='Uploaded Image', width=300)
 
             # Generate the appropriate prompt for the selected image type
             prompt = get_image_description_prompt(image_type)
 
             # Button to generate descriptions
             if st.button("Generate Description"):
+                if image_type == "Product Image":
+                    # Crop the plain background so the model only receives the product
+                    image, trim_report = trim_model_image(image)
+                    st.caption(trim_report.summary())
                 generated_text = generate_image_descriptions(image, prompt)
                 st.text_area("Generated Description (Editable)", value=generated_text, height=150)
 
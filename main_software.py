@@ -1,118 +1,115 @@
 import streamlit as st
-from PIL import Image
-import io
 import os
 import requests
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Google API Configuration
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=GOOGLE_API_KEY)
-
-model = genai.GenerativeModel("models/gemini-1.5-flash-002")
-
+from annotation_store import get_annotation_store
+from background_trim import trim_model_image
+from captioning import GENERATION_ERROR_MESSAGE, generate_caption, get_prompt
+from prefetch import prefetch_image
+from image_memory import image_memory, streamlit_session_id, active_streamlit_session_ids
+from profiling import arm, profile_action, profile_rerun
 
 # Predefined password
 APP_PASSWORD = os.getenv("APP_PASSWORD")  # Load password from environment variab
 
-# Function to download and convert image from URL to a PIL image
-def download_image_from_url(image_url):
-    """Downloads image from a URL and converts it to a PIL image."""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Referer": "https://www.bivouac.co.nz/"
-    }
+# Logging in with this password also unlocks admin tools such as the profiler
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+
+# Function to start downloading and preparing an image as soon as its URL field changes
+def start_prefetch(url_key):
+    """on_change callback for the URL inputs; runs before the rerun so the fetch overlaps it."""
+    prefetch_image(st.session_state, f"{url_key}_prefetch", st.session_state[url_key].strip())
+
+# Function to get the prefetched image for a URL as a model-ready image
+def download_image_from_url(image_url, url_key):
+    """Waits for the background prefetch of the URL and returns it as a model-ready ModelImage."""
     try:
-        response = requests.get(image_url, headers=headers)
-        response.raise_for_status()  # Raise an error for invalid URLs
-        img = Image.open(io.BytesIO(response.content))
-        return img
+        task = prefetch_image(st.session_state, f"{url_key}_prefetch", image_url.strip())
+        image = task.result()
+        session_id = streamlit_session_id()
+        if session_id:
+            image_memory.register(session_id, url_key, image)
+        return image
     except requests.exceptions.HTTPError as http_err:
         st.error(f"HTTP error occurred: {http_err}")
     except Exception as e:
         st.error(f"Error loading image: {str(e)}")
     return None
 
-# Function to generate image descriptions using LLM
-def generate_image_descriptions(image, prompt):
-    """Send image and prompt to LLM to get descriptions."""
-    try:
-        response = model.generate_content([prompt, image])
-        generated_text = response.candidates[0].content.parts[0].text
-        return generated_text
-    except Exception as e:
-        return "Usage limit reached or an error occurred."
-
- # Function to get prompt based on image type
-def get_prompt(image_type):
-    """Return the appropriate prompt based on the image type."""
-    if image_type == "Product Image":
-        return (           
-           """**For the Short Description:**
-
-            - Emphasize simplicity and conciseness.
-            - Focus on the essential elements: the object's identity, shape (if applicable), function, material, and color.
-            - Ensure you keep the description between 8 to 15 words but ensure is under 15 words.
-            - Avoid excessive detail and focus on the core attributes.
-            - Example: "Cordless vacuum, light blue base, silver-gold handle."
-
-            **For the Long Description:**
-
-            - Provide comprehensive details, including color, material, brand or manufacturer, and additional features.
-            - Describe the background of the image including any artistic or design elements.
-            - Include any text present on the image or the product itself.
-            - Avoid promotional language and focus on objective description for machine learning understanding.
-            - Limit details to those observable in the image, excluding information only available from product descriptions.
-            - Any positioning should be based on your perspective looking at the image e.g. left, right
-            - Ensure you pay attention to the position of the product in the image and include the detail in the decription.
-            - Finally, ensure you include every details in the image.
-            """
-        )
-    elif image_type == "Lifestyle Image":
-        return ("""  For the Short Description of the Lifestyle Image:
-
-                    Emphasize simplicity and conciseness.
-                    Focus on key elements: object, shape, function, material, and color.
-                    Ensure you keep the description between 8 to 15 words but ensure is under 15 words.
-                    Avoid excessive detail and focus on core attributes.
-                    Example: "Person using a blue laptop at a cafe."
-                    For the Long Description:
-
-                    Provide comprehensive details, including colors, materials, brands, and features.
-                    Describe the background if it contains design elements.
-                    Include any text present on the image or the product.
-                    Avoid promotional language and focus on objective description for machine learning.
-                    Limit details to those observable in the image, excluding information from product descriptions.
-                    Use a consistent perspective (e.g., left, right) for positioning.
-                    Avoid describing feelings or emotions tied to the image.
-                    Focus on positions like left, right, centered, etc.
-                    Provide detailed descriptions of the person using the product, including color, hairstyle, posture, etc.
-                    Ensure the description fully captures the lifestyle context of the image.
-                    Any positioning should be based on your perspective looking at the image e.g. left, right
-                    - Ensure you pay attention to the position of the product in the image and include the detail in the decription 
-                    - if the person in the image is holding any object consider the positioning of the object held interm of wheher rigth or left.
-                    - Finally, ensure you include every details in the image.
-                 """
-        )
-    return ""
-
+# Function to restore the latest saved caption for a URL, e.g. after a page refresh
+def load_saved_caption(kind, image_url):
+    """Fill an empty description from the annotation store."""
+    if st.session_state[f"{kind}_description"]:
+        return
+    saved = get_annotation_store().find_by_url(image_url, limit=1)
+    if saved:
+        text = saved[0]["edited_output"] or saved[0]["repaired_output"] or saved[0]["raw_output"]
+        st.session_state[f"{kind}_description"] = text
+        remember_saved_caption(kind, saved[0]["id"], image_url, text)
+
+
+# Function to remember which stored caption the text area edits
+def remember_saved_caption(kind, annotation_id, image_url, text):
+    """Tie the caption row to the URL it was made for, so edits never land on another image's row."""
+    st.session_state[f"{kind}_annotation_id"] = annotation_id
+    st.session_state[f"{kind}_annotation_url"] = image_url
+    st.session_state[f"{kind}_saved_text"] = text
+
+
+# Function to stop edits from updating a previously stored caption
+def forget_saved_caption(kind):
+    """Called when generation fails, so the error message is never saved over the last caption."""
+    for key in ("annotation_id", "annotation_url", "saved_text"):
+        st.session_state.pop(f"{kind}_{key}", None)
+
+
+# Function to persist a newly generated caption with its provenance
+def save_generated_caption(kind, image, image_url, image_type, prompt, result):
+    """Store the raw model output and remember its id so later edits update the same row."""
+    annotation_id = get_annotation_store().add(
+        image.digest, image_type, result.raw_text, url=image_url, model=result.tier, prompt=prompt,
+        repaired_output=result.text,
+    )
+    remember_saved_caption(kind, annotation_id, image_url, result.text)
+
+
+# Function to persist the editor's changes to a caption
+def save_edited_caption(kind, edited_text, image_url):
+    """Write the text area's content back to the store when it differs from what was last saved."""
+    annotation_id = st.session_state.get(f"{kind}_annotation_id")
+    if not annotation_id or st.session_state.get(f"{kind}_annotation_url") != image_url:
+        return
+    if edited_text != st.session_state.get(f"{kind}_saved_text"):
+        get_annotation_store().update_edited(annotation_id, edited_text)
+        st.session_state[f"{kind}_saved_text"] = edited_text
 
 # Function to verify user login
 def login(password_input):
     """Simple function to verify the password."""
-    if password_input == APP_PASSWORD:
+    if password_input == APP_PASSWORD or (ADMIN_PASSWORD and password_input == ADMIN_PASSWORD):
         st.session_state["logged_in"] = True
+        st.session_state["is_admin"] = bool(ADMIN_PASSWORD) and password_input == ADMIN_PASSWORD
         st.success("Login successful! You can now use the app.")
     else:
         st.error("Incorrect password. Please try again.")
 
+# Function to show the admin profiler controls and the last profile's hot functions
+def show_profiler_controls():
+    """Sidebar panel that arms the sampling profiler for this session's next reruns."""
+    with st.sidebar.expander("Profiler", expanded=False):
+        runs = st.number_input("Reruns to profile", min_value=1, max_value=50, value=5)
+        if st.button("Profile next reruns"):
+            arm(st.session_state, int(runs))
+        runs_left = st.session_state.get("profile_runs_left", 0)
+        if runs_left:
+            st.caption(f"Profiling the next {runs_left} rerun(s).")
+        last_profile = st.session_state.get("last_profile")
+        if last_profile:
+            st.caption(
+                f"Last profile: {last_profile['seconds']}s, {last_profile['samples']} samples, "
+                f"saved to {last_profile['path']}"
+            )
+            st.dataframe(last_profile["hot_functions"], hide_index=True)
+
 # Streamlit app interface
 def main():
     st.title("SBX Image Caption Generator")
@@ -140,6 +137,18 @@ def main():
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
 
+    # Keep this session alive in the image memory manager and release sessions that have ended
+    session_id = streamlit_session_id()
+    if session_id:
+        image_memory.touch(session_id, active_streamlit_session_ids)
+
+    if st.session_state.get("is_admin"):
+        show_profiler_controls()
+
+    if os.getenv("SHOW_MEMORY_REPORT"):
+        with st.sidebar.expander("Memory usage", expanded=False):
+            st.json(image_memory.report())
+
     if st.session_state["logged_in"]:
         # Initialize session state variables for persistence
         if "product_description" not in st.session_state:
@@ -153,45 +162,78 @@ def main():
         # Column 1: Product Image Section
         with col1:
             st.subheader("Product Image")
-            product_url = st.text_input("Enter Product Image URL")
+            product_url = st.text_input(
+                "Enter Product Image URL", key="product_url", on_change=start_prefetch, args=("product_url",)
+            )
 
             if product_url:
                 try:
-                    product_image = download_image_from_url(product_url)
-                    st.image(product_image, caption='Product Image', width=300)
+                    product_image = download_image_from_url(product_url, "product_url")
+                    st.image(product_image.thumbnail(), caption='Product Image', width=300)
+
+                    load_saved_caption("product", product_url)
 
                     if st.button("Generate Product Description"):
                         prompt = get_prompt("Product Image")
-                        st.session_state["product_description"] = generate_image_descriptions(product_image, prompt)
+                        # Crop the plain background so the model only receives the product
+                        model_image, trim_report = trim_model_image(product_image)
+                        st.caption(trim_report.summary())
+                        with profile_action("model_call"):
+                            result = generate_caption(model_image, prompt)
+                        if result is None:
+                            st.session_state["product_description"] = GENERATION_ERROR_MESSAGE
+                            forget_saved_caption("product")
+                        else:
+                            st.session_state["product_description"] = result.text
+                            save_generated_caption("product", product_image, product_url, "Product Image", prompt, result)
+                            if not result.validation.ok:
+                                st.warning(" ".join(result.validation.issues))
 
                 except Exception as e:
                     st.error(f"Error loading product image: {str(e)}")
 
             # Display product description with persistence
-            st.text_area("Product Description", st.session_state["product_description"], height=150)
+            edited_text = st.text_area("Product Description", st.session_state["product_description"], height=150)
+            save_edited_caption("product", edited_text, product_url)
 
         # Column 2: Lifestyle Image Section
         with col2:
             st.subheader("Lifestyle Image")
-            lifestyle_url = st.text_input("Enter Lifestyle Image URL")
+            lifestyle_url = st.text_input(
+                "Enter Lifestyle Image URL", key="lifestyle_url", on_change=start_prefetch, args=("lifestyle_url",)
+            )
 
             if lifestyle_url:
                 try:
-                    lifestyle_image = download_image_from_url(lifestyle_url)
-                    st.image(lifestyle_image, caption='Lifestyle Image', width=300)
+                    lifestyle_image = download_image_from_url(lifestyle_url, "lifestyle_url")
+                    st.image(lifestyle_image.thumbnail(), caption='Lifestyle Image', width=300)
+
+                    load_saved_caption("lifestyle", lifestyle_url)
 
                     if st.button("Generate Lifestyle Description"):
                         prompt = get_prompt("Lifestyle Image")
-                        st.session_state["lifestyle_description"] = generate_image_descriptions(lifestyle_image, prompt)
+                        with profile_action("model_call"):
+                            result = generate_caption(lifestyle_image, prompt)
+                        if result is None:
+                            st.session_state["lifestyle_description"] = GENERATION_ERROR_MESSAGE
+                            forget_saved_caption("lifestyle")
+                        else:
+                            st.session_state["lifestyle_description"] = result.text
+                            save_generated_caption("lifestyle", lifestyle_image, lifestyle_url, "Lifestyle Image", prompt, result)
+                            if not result.validation.ok:
+                                st.warning(" ".join(result.validation.issues))
 
                 except Exception as e:
                     st.error(f"Error loading lifestyle image: {str(e)}")
 
             # Display lifestyle description with persistence
-            st.text_area("Lifestyle Description", st.session_state["lifestyle_description"], height=150)
+            edited_text = st.text_area("Lifestyle Description", st.session_state["lifestyle_description"], height=150)
+            save_edited_caption("lifestyle", edited_text, lifestyle_url)
 
     else:
         st.warning("Please log in to use the application.")
 
 if __name__ == "__main__":
-    main()
+    # Only samples when an admin has armed the profiler for this session
+    with profile_rerun(st.session_state, streamlit_session_id()):
+        main()
@@ -0,0 +1,244 @@
+"""Tiered model router: try the fast model first, escalate to the larger one only when needed.
+
+Each tier's output is validated locally. A failing short description (length or forbidden
+words) is repaired with a small text-only request on the same tier; the output escalates only
+if its structure, short-description word count or long description still fail, so word choice
+alone never costs a call to the larger model but is still reported in the result's issues. Escalation rate and latency are recorded per tier.
+Every call runs under the request's Deadline and can be hedged (see deadlines.py).
+
+Run `python model_cascade.py --simulate` to check the routing offline with stand-in models.
+"""
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+from collections import deque
+
+import google.generativeai as genai
+
+from caption_validation import repair_descriptions, validate_descriptions, validate_structure
+from deadlines import LATENCY_WINDOW, MODEL_HEDGE_PERCENTILE, Deadline, DeadlineExceeded, HedgedCaller, percentile
+
+DEFAULT_CASCADE_MODELS = "models/gemini-1.5-flash-002,models/gemini-1.5-pro-002"
+
+
+class TierStats:
+    def __init__(self):
+        self.calls = 0
+        self.accepted = 0
+        self.repaired = 0
+        self.escalated = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+class CascadeResult:
+    """Text from the tier that answered, plus how it got there."""
+
+    def __init__(self, text, tier, validation, escalations, raw_text=None):
+        self.text = text
+        # What the model returned, before any short-description repair
+        self.raw_text = raw_text if raw_text is not None else text
+        self.tier = tier
+        self.validation = validation
+        self.escalations = escalations
+
+
+class ModelCascade:
+    """Route a generate_content call through tiers of models, cheapest first."""
+
+    def __init__(self, tiers, validate=validate_structure, repair=True, hedge_percentile=MODEL_HEDGE_PERCENTILE):
+        """`tiers` is a list of (name, model) pairs; `model` needs a generate_content method."""
+        if not tiers:
+            raise ValueError("A cascade needs at least one tier.")
+        self.tiers = list(tiers)
+        self.validate = validate
+        self.repair = repair
+        self._stats = {name: TierStats() for name, _ in self.tiers}
+        self._hedgers = {name: HedgedCaller(hedge_percentile, name=f"model-{index}") for index, (name, _) in enumerate(self.tiers)}
+        self._lock = threading.Lock()
+
+    def _call(self, name, model, contents, deadline):
+        def attempt(timeout):
+            # The transport timeout ends attempts that lose a hedge or outlive the deadline
+            response = model.generate_content(contents, request_options={"timeout": timeout})
+            return response.candidates[0].content.parts[0].text
+
+        start = time.perf_counter()
+        try:
+            return self._hedgers[name].call(attempt, deadline)
+        finally:
+            with self._lock:
+                stats = self._stats[name]
+                stats.calls += 1
+                stats.latencies.append(time.perf_counter() - start)
+
+    def generate(self, contents, deadline=None):
+        """Return a CascadeResult; re-raises the last tier's exception if every tier errors.
+
+        Raises DeadlineExceeded as soon as the deadline passes, without escalating further.
+        """
+        deadline = deadline or Deadline()
+        escalations = 0
+        for index, (name, model) in enumerate(self.tiers):
+            last_tier = index == len(self.tiers) - 1
+            try:
+                text = self._call(name, model, contents, deadline)
+            except Exception as e:
+                with self._lock:
+                    self._stats[name].errors += 1
+                if last_tier or isinstance(e, DeadlineExceeded):
+                    raise
+                escalations += 1
+                continue
+
+            raw_text = text
+            # Every rule, forbidden words included, decides the repair and what is reported
+            validation = validate_descriptions(text)
+            if validation.short_issues and self.repair and not deadline.expired:
+                text, validation = repair_descriptions(text, model, request_options={"timeout": deadline.remaining()})
+                if not validation.short_issues:
+                    with self._lock:
+                        self._stats[name].repaired += 1
+
+            # Only `self.validate` (structure and length by default) decides whether to escalate
+            if self.validate(text).ok or last_tier:
+                with self._lock:
+                    self._stats[name].accepted += 1
+                return CascadeResult(text, name, validation, escalations, raw_text)
+
+            with self._lock:
+                self._stats[name].escalated += 1
+            escalations += 1
+
+    def stats(self):
+        """Per-tier calls, escalation rate and latency percentiles (seconds)."""
+        report = {}
+        with self._lock:
+            for name, stats in self._stats.items():
+                latencies = sorted(stats.latencies)
+                hedging = self._hedgers[name].stats()
+                report[name] = {
+                    "calls": stats.calls,
+                    "accepted": stats.accepted,
+                    "repaired": stats.repaired,
+                    "escalated": stats.escalated,
+                    "errors": stats.errors,
+                    "escalation_rate": (stats.escalated + stats.errors) / stats.calls if stats.calls else 0.0,
+                    "latency_p50": percentile(latencies, 50),
+                    "latency_p95": percentile(latencies, 95),
+                    "latency_p99": percentile(latencies, 99),
+                    "hedge_rate": hedging["hedge_rate"],
+                    "hedge_wins": hedging["hedge_wins"],
+                    "deadline_exceeded": hedging["deadline_exceeded"],
+                }
+        return report
+
+
+# Function to build the flash -> pro cascade used by the apps
+def create_default_cascade():
+    """Build a cascade from CASCADE_MODELS (comma-separated, fastest first)."""
+    names = [name.strip() for name in os.getenv("CASCADE_MODELS", DEFAULT_CASCADE_MODELS).split(",") if name.strip()]
+    return ModelCascade([(name, genai.GenerativeModel(name)) for name in names])
+
+
+class StandInResponse:
+    """Mimics the response.candidates[0].content.parts[0].text shape the apps read."""
+
+    def __init__(self, text):
+        part = type("Part", (), {"text": text})()
+        content = type("Content", (), {"parts": [part]})()
+        self.candidates = [type("Candidate", (), {"content": content})()]
+
+
+class StandInModel:
+    """Offline stand-in for a Gemini tier with a given latency and chance of a bad caption."""
+
+    GOOD = (
+        "**Short Description:** Sleeveless long printed dress with round neckline on white background.\n\n"
+        "**Long Description:** A sleeveless long dress with a printed pattern, centered on a plain white background."
+    )
+    SHORT_TOO_LONG = (
+        "**Short Description:** A sleeveless long printed dress with a round neckline and a flowing skirt "
+        "shown on a plain white studio background.\n\n"
+        "**Long Description:** A sleeveless long dress with a printed pattern, centered on a plain white background."
+    )
+    BROKEN = "The image shows a dress."
+
+    def __init__(self, latency, short_failure_rate, broken_rate, tail_rate=0.0):
+        self.latency = latency
+        self.short_failure_rate = short_failure_rate
+        self.broken_rate = broken_rate
+        # Share of calls that stall for 10x the usual latency, like a stuck backend replica
+        self.tail_rate = tail_rate
+
+    def generate_content(self, contents, **kwargs):
+        if isinstance(contents, str):
+            # Text-only short-description repair: small and fast
+            time.sleep(self.latency * 0.2)
+            return StandInResponse("Sleeveless long printed dress with round neckline on white background.")
+        latency = self.latency * 10 if random.random() < self.tail_rate else random.gauss(self.latency, self.latency * 0.2)
+        # Honour the transport timeout like the real client, so abandoned hedges stop early
+        timeout = kwargs.get("request_options", {}).get("timeout")
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("stand-in model call timed out")
+        time.sleep(max(0.0, latency))
+        roll = random.random()
+        if roll < self.broken_rate:
+            return StandInResponse(self.BROKEN)
+        if roll < self.broken_rate + self.short_failure_rate:
+            return StandInResponse(self.SHORT_TOO_LONG)
+        return StandInResponse(self.GOOD)
+
+
+def simulate(requests, flash_latency, pro_latency, flash_short_failure, flash_broken, tail_rate=0.0, hedge_percentile=None):
+    """Run the cascade against stand-in tiers and return (stats, end-to-end latencies)."""
+    cascade = ModelCascade([
+        ("flash", StandInModel(flash_latency, flash_short_failure, flash_broken, tail_rate)),
+        ("pro", StandInModel(pro_latency, 0.02, 0.0, tail_rate)),
+    ], hedge_percentile=hedge_percentile)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        cascade.generate(["prompt", {"mime_type": "image/jpeg", "data": b""}])
+        latencies.append(time.perf_counter() - start)
+    return cascade.stats(), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the flash -> pro cascade offline.")
+    parser.add_argument("--simulate", action="store_true", help="Run the offline simulation.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--flash-latency", type=float, default=0.02)
+    parser.add_argument("--pro-latency", type=float, default=0.08)
+    parser.add_argument("--flash-short-failure", type=float, default=0.25, help="Share of flash captions with a bad short description.")
+    parser.add_argument("--flash-broken", type=float, default=0.05, help="Share of flash captions missing a section.")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Share of calls that take 10x the usual latency.")
+    parser.add_argument("--hedge-percentile", type=float, default=None, help="Hedge calls slower than this latency percentile.")
+    args = parser.parse_args()
+    if not args.simulate:
+        parser.print_help()
+        return
+
+    stats, latencies = simulate(
+        args.requests, args.flash_latency, args.pro_latency, args.flash_short_failure, args.flash_broken,
+        args.tail_rate, args.hedge_percentile,
+    )
+    for name, tier in stats.items():
+        print(
+            f"{name:<6} calls={tier['calls']:<5} accepted={tier['accepted']:<5} repaired={tier['repaired']:<5} "
+            f"escalation_rate={tier['escalation_rate']:.1%} hedge_rate={tier['hedge_rate']:.1%} "
+            f"p50={tier['latency_p50'] or 0:.3f}s p99={tier['latency_p99'] or 0:.3f}s"
+        )
+    latencies.sort()
+    print(
+        f"end-to-end p50={statistics.median(latencies):.3f}s p99={percentile(latencies, 99):.3f}s "
+        f"(flash alone ~{args.flash_latency:.3f}s, pro alone ~{args.pro_latency:.3f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from deadlines import Deadline
+from image_formats import prepare_model_image
+from profiling import profile_thread
+
+# Headers the apps have always sent when fetching product images
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
+    "Accept": "image/avif,image/webp,image/*,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Referer": "https://www.bivouac.co.nz/",
+}
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "8"))
+
+# (connect, read) timeouts in seconds for image downloads
+DOWNLOAD_TIMEOUT = (5, 20)
+
+# Overall budget for one download, however slowly the server trickles bytes
+DOWNLOAD_DEADLINE_SECONDS = float(os.getenv("DOWNLOAD_DEADLINE_SECONDS", "30"))
+
+
+class PrefetchCancelled(Exception):
+    """Raised inside a prefetch whose URL was replaced before it finished."""
+
+
+# Function to build the process-wide pooled HTTP client
+def create_http_session(pool_size=PREFETCH_WORKERS * 2):
+    """Return a requests.Session that keeps connections alive across downloads and sessions."""
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+# Function to download raw image bytes, checking for cancellation between chunks
+def fetch_image_bytes(url, cancelled=None, session=None, deadline=None):
+    """Download the image at url with the shared pooled client, within the deadline."""
+    session = session or http_session
+    deadline = deadline or Deadline(DOWNLOAD_DEADLINE_SECONDS)
+    deadline.check("image download")
+    connect_timeout, read_timeout = DOWNLOAD_TIMEOUT
+    timeout = (min(connect_timeout, deadline.remaining()), min(read_timeout, deadline.remaining()))
+    with session.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        chunks = []
+        for chunk in response.iter_content(64 * 1024):
+            if cancelled is not None and cancelled.is_set():
+                raise PrefetchCancelled(url)
+            deadline.check("image download")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class PrefetchTask:
+    """A background download + preprocessing job for one URL."""
+
+    def __init__(self, url, cancelled):
+        self.url = url
+        self.future = None
+        self._cancelled = cancelled
+        # Worker thread running the job, so a profiled rerun waiting on it can sample it
+        self.thread_id = None
+
+    def cancel(self):
+        """Stop the job: drop it if it is still queued, or abort the download at the next chunk."""
+        self._cancelled.set()
+        self.future.cancel()
+
+    @property
+    def failed(self):
+        """True once the job has finished with an error; the next rerun should retry it."""
+        return self.future.done() and (self.future.cancelled() or self.future.exception() is not None)
+
+    def result(self, timeout=DOWNLOAD_DEADLINE_SECONDS):
+        """Wait for and return the ModelImage, re-raising any download or decode error."""
+        with profile_thread(self.thread_id, "image_download"):
+            return self.future.result(timeout)
+
+
+class Prefetcher:
+    """Shared worker pool that downloads, probes, thumbnails and encodes images ahead of use."""
+
+    def __init__(self, max_workers=PREFETCH_WORKERS, session=None):
+        self.session = session or http_session
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+
+    def submit(self, url):
+        task = PrefetchTask(url, threading.Event())
+        task.future = self._executor.submit(self._run, task)
+        return task
+
+    def _run(self, task):
+        task.thread_id = threading.get_ident()
+        url, cancelled = task.url, task._cancelled
+        data = fetch_image_bytes(url, cancelled, self.session)
+        if cancelled.is_set():
+            raise PrefetchCancelled(url)
+        # Probe + transcode once (cached by content), then build the preview the page shows
+        model_image = prepare_model_image(data)
+        model_image.thumbnail()
+        return model_image
+
+
+prefetcher = Prefetcher()
+
+
+# Function to get the prefetch for a URL held in a session, replacing a stale one
+def prefetch_image(state, key, url):
+    """Return the PrefetchTask stored under state[key] for url, starting a new one if the URL changed
+    or the previous attempt failed.
+
+    `state` is any mutable mapping, normally st.session_state.
+    """
+    task = state.get(key)
+    if task is not None and task.url == url and not task.failed:
+        return task
+    if task is not None:
+        task.cancel()
+    if not url:
+        state[key] = None
+        return None
+    task = prefetcher.submit(url)
+    state[key] = task
+    return task
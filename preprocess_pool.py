@@ -0,0 +1,227 @@
+"""Multi-core image preprocessing for batch captioning and mirror jobs.
+
+Decode, resize and re-encode run in a process pool so every core does PIL work. Image bytes
+travel to and from the workers through shared memory instead of being pickled through a
+pipe, per-image stats (dimensions, mean/std color) are computed with vectorized NumPy, and
+downloads run on a thread pool that feeds the process pool, so I/O overlaps with compute.
+
+    python preprocess_pool.py urls.txt --output-dir mirrored_images --workers 8
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from advanced_image_downloader import get_filename
+from image_formats import MODEL_MAX_SIDE, open_image_bytes, sniff_image_format
+from prefetch import fetch_image_bytes
+
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+
+# Downloads in flight per preprocessing worker, enough to keep the CPUs fed
+FETCH_PER_WORKER = 4
+
+
+class PreprocessResult:
+    """Model-ready JPEG bytes and stats for one source image."""
+
+    def __init__(self, data, width, height, source_format, mean_color, std_color):
+        self.data = data
+        self.mime_type = "image/jpeg"
+        self.width = width
+        self.height = height
+        self.source_format = source_format
+        self.mean_color = mean_color
+        self.std_color = std_color
+
+    def stats(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "source_format": self.source_format,
+            "bytes": len(self.data),
+            "mean_color": self.mean_color,
+            "std_color": self.std_color,
+        }
+
+
+def image_stats(pixels):
+    """Mean and standard deviation per RGB channel of an (H, W, 3) uint8 array."""
+    flat = pixels.reshape(-1, pixels.shape[-1]).astype(np.float32)
+    return [round(float(v), 2) for v in flat.mean(axis=0)], [round(float(v), 2) for v in flat.std(axis=0)]
+
+
+def _preprocess_in_worker(input_name, input_size, max_side, quality):
+    """Runs in a worker process: read bytes from shared memory, process, write the result back."""
+    source = shared_memory.SharedMemory(name=input_name)
+    try:
+        data = bytes(source.buf[:input_size])
+    finally:
+        source.close()
+
+    image_format = sniff_image_format(data)
+    with open_image_bytes(data, image_format) as image:
+        if image.format == "JPEG":
+            image.draft("RGB", (max_side, max_side))
+        image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side))
+
+    mean_color, std_color = image_stats(np.asarray(image))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    encoded = buffer.getbuffer()
+
+    # The parent copies the result out and unlinks the block
+    output = shared_memory.SharedMemory(create=True, size=max(1, len(encoded)))
+    output.buf[:len(encoded)] = encoded
+    output_name = output.name
+    output.close()
+    return output_name, len(encoded), image.width, image.height, image_format, mean_color, std_color
+
+
+def _collect_output(output_name, output_size):
+    block = shared_memory.SharedMemory(name=output_name)
+    try:
+        return bytes(block.buf[:output_size])
+    finally:
+        block.close()
+        block.unlink()
+
+
+class PreprocessPool:
+    """Process pool that preprocesses image bytes passed through shared memory."""
+
+    def __init__(self, workers=PREPROCESS_WORKERS, max_side=MODEL_MAX_SIDE, quality=90):
+        self.workers = workers
+        self.max_side = max_side
+        self.quality = quality
+        # Workers start lazily, from a download thread's callback while other downloads are
+        # mid-request; fork() from a multi-threaded process can deadlock the child, so they are
+        # started from a clean forkserver process (spawn where that isn't available)
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+
+    def submit(self, data):
+        """Queue image bytes for preprocessing; returns a Future of PreprocessResult."""
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        block.buf[:len(data)] = data
+        worker_future = self._executor.submit(
+            _preprocess_in_worker, block.name, len(data), self.max_side, self.quality
+        )
+        result = Future()
+
+        def done(future):
+            block.close()
+            block.unlink()
+            try:
+                output_name, output_size, width, height, image_format, mean_color, std_color = future.result()
+                data = _collect_output(output_name, output_size)
+                result.set_result(PreprocessResult(data, width, height, image_format, mean_color, std_color))
+            except Exception as e:
+                result.set_exception(e)
+
+        worker_future.add_done_callback(done)
+        return result
+
+    def map_urls(self, urls, max_in_flight=None):
+        """Download urls on threads and preprocess them on processes as downloads finish.
+
+        Yields (url, PreprocessResult or Exception) as soon as each image is done. At most
+        max_in_flight images (default workers * FETCH_PER_WORKER) are downloading, waiting in
+        shared memory or waiting to be consumed, so memory and /dev/shm use stay flat however
+        many URLs there are.
+        """
+        max_in_flight = max_in_flight or self.workers * FETCH_PER_WORKER
+        slots = threading.Semaphore(max_in_flight)
+        finished = queue.Queue()
+
+        def preprocess(url, download):
+            try:
+                self.submit(download.result()).add_done_callback(lambda future: finished.put((url, future)))
+            except Exception as e:
+                finished.put((url, e))
+
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="fetch") as fetchers:
+            submitted = 0
+            for url in urls:
+                # Every slot is held by an unfinished item, so waiting for the next result frees one
+                while not slots.acquire(blocking=False):
+                    submitted -= yield from self._drain(finished, slots, block=True)
+                fetchers.submit(fetch_image_bytes, url).add_done_callback(
+                    lambda download, url=url: preprocess(url, download)
+                )
+                submitted += 1
+                submitted -= yield from self._drain(finished, slots, block=False)
+            while submitted:
+                submitted -= yield from self._drain(finished, slots, block=True)
+
+    def _drain(self, finished, slots, block):
+        """Yield finished (url, result) pairs, freeing one slot per item; returns the number yielded."""
+        count = 0
+        while True:
+            try:
+                url, outcome = finished.get(block=block and count == 0)
+            except queue.Empty:
+                return count
+            if isinstance(outcome, Future):
+                try:
+                    outcome = outcome.result()
+                except Exception as e:
+                    outcome = e
+            slots.release()
+            count += 1
+            yield url, outcome
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to mirror a list of image URLs as model-ready JPEGs plus a stats file
+def mirror_images(urls, output_dir="images", workers=PREPROCESS_WORKERS, max_side=MODEL_MAX_SIDE):
+    """Download, preprocess and save images; stats for every image go to stats.jsonl in output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    saved = 0
+    with PreprocessPool(workers, max_side) as pool, open(os.path.join(output_dir, "stats.jsonl"), "a") as stats_file:
+        for url, result in pool.map_urls(urls):
+            if isinstance(result, Exception):
+                print(f"Failed to process {url}: {result}")
+                continue
+            filename = os.path.splitext(get_filename(url, result.source_format))[0] + ".jpg"
+            with open(os.path.join(output_dir, filename), "wb") as f:
+                f.write(result.data)
+            stats_file.write(json.dumps(dict(result.stats(), url=url, filename=filename)) + "\n")
+            saved += 1
+            print(f"Processed: {filename} ({result.width}x{result.height})")
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mirror image URLs as model-ready JPEGs using every core.")
+    parser.add_argument("url_file", help="Text file with one image URL per line.")
+    parser.add_argument("--output-dir", default="images")
+    parser.add_argument("--workers", type=int, default=PREPROCESS_WORKERS)
+    parser.add_argument("--max-side", type=int, default=MODEL_MAX_SIDE)
+    args = parser.parse_args()
+
+    with open(args.url_file) as f:
+        urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    saved = mirror_images(urls, args.output_dir, args.workers, args.max_side)
+    print(f"Saved {saved} of {len(urls)} images to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""On-demand sampling profiler for the Streamlit apps.
+
+An admin arms it for the next N reruns of their own session. While armed, a background
+thread samples the script thread's stack every PROFILE_INTERVAL seconds (sys._current_frames),
+so the app code runs unchanged. Work the rerun hands to other threads is sampled too: model
+attempts on the hedger's "model-N" workers (wrapped with profile_worker when submitted) and
+the prefetch worker a rerun waits on (profile_thread). Each rerun is written to PROFILE_DIR
+as folded stacks ("frame;frame;frame count" per line), which flamegraph.pl, inferno and
+speedscope read directly; the session id, the action (the rerun, and any model call inside
+it) and, for worker samples, the worker's thread name are the root frames. When nothing is
+armed, profile_rerun, profile_action, profile_worker and profile_thread only check a flag.
+
+    flamegraph.pl profiles/*.folded > flame.svg
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Seconds between stack samples while a rerun is being profiled
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+# Rows in the hot-function table shown in the sidebar
+HOT_FUNCTION_LIMIT = 15
+
+_active = threading.local()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Background thread that counts (labels, stack) pairs for the threads it follows."""
+
+    def __init__(self, thread_id, labels, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self._threads = {thread_id: labels}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def follow(self, thread_id, labels):
+        """Also sample thread_id, under labels, until unfollow."""
+        with self._lock:
+            self._threads[thread_id] = labels
+
+    def unfollow(self, thread_id):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                followed = list(self._threads.items())
+            frames = sys._current_frames()
+            for thread_id, labels in followed:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    self.counts[(tuple(labels), tuple(reversed(stack)))] += 1
+
+
+def write_folded(path, counts):
+    """Write (labels, stack) counts in the folded format flamegraph tools read, labels first."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for (labels, stack), count in counts.most_common():
+            f.write(f"{';'.join(frame.replace(';', ',') for frame in labels + stack)} {count}\n")
+
+
+def hot_functions(counts, limit=HOT_FUNCTION_LIMIT):
+    """Functions ranked by self samples (% of all samples), with their inclusive share."""
+    total = sum(counts.values())
+    own = Counter()
+    inclusive = Counter()
+    for (_, stack), count in counts.items():
+        own[stack[-1]] += count
+        for frame in set(stack):
+            inclusive[frame] += count
+    return [
+        {
+            "function": frame,
+            "self_pct": round(100 * count / total, 1),
+            "total_pct": round(100 * inclusive[frame] / total, 1),
+            "samples": count,
+        }
+        for frame, count in own.most_common(limit)
+    ]
+
+
+# Function to arm the profiler for the next reruns of a session
+def arm(state, runs):
+    """Profile the next `runs` reruns of the session owning `state` (st.session_state)."""
+    state["profile_runs_left"] = runs
+
+
+@contextmanager
+def profile_rerun(state, session_id, action="rerun"):
+    """Sample the script thread for this rerun if the session has profile runs left.
+
+    The folded file path and the hot-function table are left in state["last_profile"].
+    """
+    if not state.get("profile_runs_left") or getattr(_active, "labels", None) is not None:
+        yield
+        return
+
+    state["profile_runs_left"] -= 1
+    labels = [session_id or "no-session", action]
+    sampler = StackSampler(threading.get_ident(), labels)
+    _active.labels = labels
+    _active.sampler = sampler
+    started = time.time()
+    sampler.start()
+    try:
+        yield
+    finally:
+        counts = sampler.stop()
+        _active.labels = None
+        _active.sampler = None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+        prefix = re.sub(r"[^A-Za-z0-9]+", "-", labels[0])[:8]
+        path = os.path.join(PROFILE_DIR, f"{prefix}-{stamp}-{int(started * 1000) % 1000:03d}.folded")
+        write_folded(path, counts)
+        state["last_profile"] = {
+            "path": path,
+            "seconds": round(time.time() - started, 3),
+            "samples": sum(counts.values()),
+            "hot_functions": hot_functions(counts),
+        }
+
+
+@contextmanager
+def profile_action(action):
+    """Label samples taken inside the block (e.g. a model call) while a rerun is being profiled."""
+    labels = getattr(_active, "labels", None)
+    if labels is None:
+        yield
+        return
+    labels.append(action)
+    try:
+        yield
+    finally:
+        labels.pop()
+
+
+# Function to carry the current profile over to a worker thread
+def profile_worker(fn):
+    """Wrap fn, before submitting it to an executor, so the worker running it is sampled too.
+
+    Samples are labelled with the submitting rerun's labels plus the worker's thread name.
+    Returns fn unchanged when this thread isn't being profiled.
+    """
+    sampler = getattr(_active, "sampler", None)
+    if sampler is None:
+        return fn
+    labels = list(_active.labels)
+
+    def run(*args, **kwargs):
+        thread_id = threading.get_ident()
+        sampler.follow(thread_id, labels + [threading.current_thread().name])
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sampler.unfollow(thread_id)
+
+    return run
+
+
+@contextmanager
+def profile_thread(thread_id, action):
+    """Also sample another, already running thread (e.g. a download being waited on) inside the block."""
+    sampler = getattr(_active, "sampler", None)
+    if sampler is None or thread_id is None:
+        yield
+        return
+    sampler.follow(thread_id, _active.labels + [action])
+    try:
+        yield
+    finally:
+        sampler.unfollow(thread_id)
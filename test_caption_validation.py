@@ -0,0 +1,100 @@
+import unittest
+
+from caption_validation import replace_short_description, split_descriptions, validate_descriptions, validate_structure
+from model_cascade import ModelCascade, StandInResponse
+
+SHORT = "Sleeveless long printed dress with round neckline on white background."
+LONG = "A sleeveless long dress with a printed pattern, centered on a plain white background."
+
+
+class SectionHeadingTest(unittest.TestCase):
+    """Heading shapes the models produce, including the prompt's own wording."""
+
+    HEADINGS = [
+        ("**Short Description:**", "**Long Description:**"),
+        ("## Short Description\n", "## Long Description\n"),
+        ("**For the Short Description:**", "**For the Long Description:**"),
+        ("For the Short Description of the Lifestyle Image:", "For the Long Description:"),
+        ("1. **Short Description:**", "2. **Long Description:**"),
+        ("1) Short Description:", "2) Long Description:"),
+        ("- **Short Description:**", "- **Long Description:**"),
+    ]
+
+    def test_split_finds_both_sections(self):
+        for short_heading, long_heading in self.HEADINGS:
+            with self.subTest(heading=short_heading):
+                text = f"{short_heading} {SHORT}\n\n{long_heading} {LONG}"
+                self.assertEqual(split_descriptions(text), (SHORT, LONG))
+                self.assertTrue(validate_descriptions(text).ok)
+
+    def test_heading_on_its_own_line(self):
+        text = f"**For the Short Description:**\n{SHORT}\n\n**For the Long Description:**\n{LONG}"
+        self.assertEqual(split_descriptions(text), (SHORT, LONG))
+
+    def test_missing_section_is_reported(self):
+        result = validate_descriptions(f"**Short Description:** {SHORT}")
+        self.assertEqual(result.long_issues, ["Long description is missing."])
+
+
+class ReplaceShortDescriptionTest(unittest.TestCase):
+    def test_replaces_body_for_each_heading_shape(self):
+        for short_heading, long_heading in SectionHeadingTest.HEADINGS:
+            with self.subTest(heading=short_heading):
+                text = f"{short_heading} Dress.\n\n{long_heading} {LONG}"
+                repaired = replace_short_description(text, SHORT)
+                self.assertEqual(repaired.count(SHORT), 1)
+                self.assertNotIn("Dress.", repaired)
+                self.assertEqual(split_descriptions(repaired), (SHORT, LONG))
+
+    def test_prepends_when_short_section_is_missing(self):
+        repaired = replace_short_description(f"**Long Description:** {LONG}", SHORT)
+        self.assertEqual(split_descriptions(repaired), (SHORT, LONG))
+
+
+class FixedModel:
+    """Returns `text` for captions and `fixed_short` for the text-only short-description repair."""
+
+    def __init__(self, text, fixed_short=SHORT):
+        self.text = text
+        self.fixed_short = fixed_short
+        self.calls = 0
+        self.repairs = 0
+
+    def generate_content(self, contents, **kwargs):
+        if isinstance(contents, str):
+            self.repairs += 1
+            return StandInResponse(self.fixed_short)
+        self.calls += 1
+        return StandInResponse(self.text)
+
+
+class StructureValidationTest(unittest.TestCase):
+    """The cascade escalates on structure and length only; word choice is repaired and reported."""
+
+    TEXT = f"**Short Description:** {SHORT.replace('printed', 'stunning')}\n\n**Long Description:** {LONG}"
+
+    def test_forbidden_words_pass_structure_check(self):
+        self.assertFalse(validate_descriptions(self.TEXT).ok)
+        self.assertTrue(validate_structure(self.TEXT).ok)
+
+    def test_forbidden_short_word_is_repaired_without_escalating(self):
+        flash = FixedModel(self.TEXT)
+        pro = FixedModel(self.TEXT)
+        result = ModelCascade([("flash", flash), ("pro", pro)]).generate(["prompt"])
+        self.assertEqual((result.tier, result.escalations), ("flash", 0))
+        self.assertEqual((flash.repairs, pro.calls), (1, 0))
+        self.assertEqual(split_descriptions(result.text)[0], SHORT)
+        self.assertEqual(result.raw_text, self.TEXT)
+        self.assertTrue(result.validation.ok)
+
+    def test_unrepaired_forbidden_words_are_reported_without_escalating(self):
+        text = f"**Short Description:** {SHORT}\n\n**Long Description:** A stunning, luxurious dress."
+        flash = FixedModel(text)
+        pro = FixedModel(text)
+        result = ModelCascade([("flash", flash), ("pro", pro)]).generate(["prompt"])
+        self.assertEqual((result.tier, pro.calls, flash.repairs), ("flash", 0, 0))
+        self.assertEqual(result.validation.long_issues, ["Long description uses forbidden words: stunning, luxurious."])
+
+
+if __name__ == "__main__":
+    unittest.main()
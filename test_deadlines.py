@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+
+from deadlines import HEDGE_ATTEMPT_TIMEOUT_FACTOR, HEDGE_MIN_SAMPLES, Deadline, DeadlineExceeded, HedgedCaller
+
+
+def warm_up(caller, latency=0.01):
+    """Give the caller enough latency samples for hedging to start."""
+    for _ in range(HEDGE_MIN_SAMPLES):
+        caller.call(lambda timeout: time.sleep(latency) or "warm", Deadline(5))
+
+
+class HedgedCallerTest(unittest.TestCase):
+    def test_no_hedging_without_enough_samples(self):
+        caller = HedgedCaller(hedge_percentile=50, max_workers=2)
+        self.assertIsNone(caller.hedge_delay())
+        self.assertEqual(caller.call(lambda timeout: "ok", Deadline(5)), "ok")
+        self.assertEqual(caller.stats()["hedges"], 0)
+
+    def test_hedge_wins_when_primary_stalls(self):
+        caller = HedgedCaller(hedge_percentile=50, max_workers=4)
+        warm_up(caller)
+        release = threading.Event()
+        attempts = []
+
+        def fn(timeout):
+            attempts.append(timeout)
+            if len(attempts) == 1:
+                release.wait(timeout)
+                return "primary"
+            return "hedge"
+
+        try:
+            self.assertEqual(caller.call(fn, Deadline(5)), "hedge")
+        finally:
+            release.set()
+        stats = caller.stats()
+        self.assertEqual((stats["hedges"], stats["hedge_wins"]), (1, 1))
+        self.assertEqual(len(attempts), 2)
+
+    def test_queued_attempts_are_cancelled_at_deadline(self):
+        # The only worker is busy, so the attempt is still queued when the deadline passes
+        caller = HedgedCaller(max_workers=1)
+        release = threading.Event()
+        blocker = caller._executor.submit(release.wait, 5)
+        attempts = []
+        try:
+            with self.assertRaises(DeadlineExceeded):
+                caller.call(lambda timeout: attempts.append(timeout), Deadline(0.05))
+        finally:
+            release.set()
+        blocker.result()
+        caller._executor.submit(lambda: None).result()
+        self.assertEqual(attempts, [])
+        self.assertEqual(caller.stats()["deadline_exceeded"], 1)
+
+    def test_running_attempt_past_deadline(self):
+        caller = HedgedCaller(max_workers=1)
+        release = threading.Event()
+        try:
+            with self.assertRaises(DeadlineExceeded):
+                # Ignores its timeout, like a transport that doesn't honour it
+                caller.call(lambda timeout: release.wait(5), Deadline(0.05))
+        finally:
+            release.set()
+        self.assertEqual(caller.stats()["deadline_exceeded"], 1)
+        with self.assertRaises(DeadlineExceeded):
+            caller.call(lambda timeout: "late", Deadline(0))
+
+    def test_errors_are_reraised(self):
+        caller = HedgedCaller(max_workers=1)
+
+        def fn(timeout):
+            raise ConnectionError("backend down")
+
+        with self.assertRaises(ConnectionError):
+            caller.call(fn, Deadline(5))
+
+    def test_attempt_timeout_is_bounded_while_hedging(self):
+        caller = HedgedCaller(hedge_percentile=50, max_workers=2)
+        self.assertAlmostEqual(caller.attempt_timeout(Deadline(5)), 5, places=1)
+        warm_up(caller)
+        p99 = caller._latency_percentile(99)
+        self.assertLessEqual(caller.attempt_timeout(Deadline(5)), p99 * HEDGE_ATTEMPT_TIMEOUT_FACTOR)
+        self.assertAlmostEqual(HedgedCaller(max_workers=1).attempt_timeout(Deadline(5)), 5, places=1)
+
+    def test_stats(self):
+        caller = HedgedCaller(hedge_percentile=50, max_workers=2)
+        warm_up(caller)
+        stats = caller.stats()
+        self.assertEqual(stats["calls"], HEDGE_MIN_SAMPLES)
+        self.assertEqual(stats["hedge_rate"], stats["hedges"] / HEDGE_MIN_SAMPLES)
+        self.assertGreaterEqual(stats["queue_wait_p99"], 0)
+        self.assertNotIn("latency_p99", stats)
+
+
+if __name__ == "__main__":
+    unittest.main()